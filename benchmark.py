@@ -0,0 +1,248 @@
+"""
+File: benchmark.py
+
+Description:
+Benchmarks how the stages of demo_and_select_open_source.py scale. A synthetic `data/src` + `data/leaf/origin_*` tree
+is generated at the requested scale, with skewed group sizes, and the scan, grouping, thumbnailing and HTML stages
+are timed and memory-profiled on it. Output page sizes are measured, and the results are written as JSON so runs
+can be compared.
+
+Usage:
+    python benchmark.py --files 1000 10000 100000 --output bench_results.json
+    python benchmark.py --files 1000000 --stages scan group html --no-tracemalloc
+
+Attention:
+# Synthetic images are tiny JPEGs with a unique comment segment, so every file has a distinct content hash
+# (no thumbnail cache hits) while generating a million of them stays fast.
+
+
+文件：benchmark.py
+
+描述：
+测试 demo_and_select_open_source.py 各阶段的扩展性。按指定规模生成带有偏斜组大小的合成 `data/src` + `data/leaf/origin_*` 目录，
+对扫描、分组、缩略图和HTML阶段计时并统计内存，测量输出页面大小，并将结果写入JSON以便在多次运行之间比较。
+"""
+
+
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import random
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from PIL import Image
+try:
+    import resource
+except ImportError:  # not available on Windows, the RSS figures are then left out
+    resource = None
+
+import demo_and_select_open_source as demo
+
+STAGES = ("scan", "group", "thumbnails", "html")
+
+def _jpeg_variants(count=8, size=(640, 480), seed=0):
+    # A few distinct small JPEG payloads, reused for every synthetic file
+    rng = random.Random(seed)
+    variants = []
+    for _ in range(count):
+        image = Image.new("RGB", size, tuple(rng.randrange(256) for _ in range(3)))
+        for _ in range(20):
+            x, y = rng.randrange(size[0]), rng.randrange(size[1])
+            image.paste(tuple(rng.randrange(256) for _ in range(3)), (x, y, x + size[0] // 4, y + size[1] // 4))
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=80)
+        variants.append(buffer.getvalue())
+    return variants
+
+def _unique_jpeg(payload, tag):
+    # Insert a COM segment after SOI: the decode cost is unchanged but the bytes (and content hash) are unique
+    comment = tag.encode()
+    return payload[:2] + b"\xff\xfe" + (len(comment) + 2).to_bytes(2, "big") + comment + payload[2:]
+
+def skewed_group_sizes(n_files, n_templates, skew, seed=0):
+    """
+    Splits n_files leaf images over n_templates groups with Zipf-like sizes.
+
+    Parameters:
+        n_files (int): The total number of leaf images.
+        n_templates (int): The number of groups, between 1 and n_files since every group has at least one image.
+        skew (float): The Zipf exponent, 0 gives equal groups, larger values give a few huge groups.
+        seed (int): The seed used to shuffle which templates get the large groups.
+
+    Returns:
+        list: The number of images of every template, summing to n_files.
+    """
+    if not 1 <= n_templates <= n_files:
+        raise ValueError(f"Cannot split {n_files} images over {n_templates} groups of at least one image")
+    weights = [1.0 / (rank ** skew) for rank in range(1, n_templates + 1)]
+    total = sum(weights)
+    # Every group gets one image and the rest is split by weight; the images left over by rounding down
+    # go to the groups with the largest fractional parts
+    shares = [(n_files - n_templates) * weight / total for weight in weights]
+    sizes = [1 + int(share) for share in shares]
+    by_fraction = sorted(range(n_templates), key=lambda i: shares[i] - int(shares[i]), reverse=True)
+    for i in by_fraction[:n_files - sum(sizes)]:
+        sizes[i] += 1
+    random.Random(seed).shuffle(sizes)
+    return sizes
+
+def generate_synthetic_tree(root, n_files, n_templates=None, skew=1.1, image_size=(640, 480), seed=0):
+    """
+    Generates a synthetic image tree in the layout expected by `read_src_img` and `read_leaf_img`.
+
+    Parameters:
+        root (str): The directory receiving `data/src` and `data/leaf`.
+        n_files (int): The total number of leaf images.
+        n_templates (int): The number of groups, defaults to n_files // 50 (at least 1).
+        skew (float): The Zipf exponent of the group sizes, see `skewed_group_sizes`.
+        image_size (tuple): The size of the synthetic images.
+        seed (int): The random seed.
+
+    Returns:
+        tuple: (src_dir, leaf_dir).
+    """
+    if n_templates is None:
+        n_templates = max(1, n_files // 50)
+    src_dir = os.path.join(root, "data", "src")
+    leaf_dir = os.path.join(root, "data", "leaf")
+    os.makedirs(src_dir, exist_ok=True)
+    variants = _jpeg_variants(size=image_size, seed=seed)
+    sizes = skewed_group_sizes(n_files, n_templates, skew, seed)
+    for template, size in enumerate(sizes, start=1):
+        payload = variants[template % len(variants)]
+        with open(os.path.join(src_dir, f"origin_{template}.jpg"), "wb") as f:
+            f.write(_unique_jpeg(payload, f"src {template}"))
+        group_dir = os.path.join(leaf_dir, f"origin_{template}")
+        os.makedirs(group_dir, exist_ok=True)
+        for i in range(size):
+            with open(os.path.join(group_dir, f"origin_{template}_{i:06d}.jpg"), "wb") as f:
+                f.write(_unique_jpeg(variants[(template + i) % len(variants)], f"leaf {template} {i}"))
+    return src_dir, leaf_dir
+
+def _rusage():
+    # (peak RSS in MB, CPU seconds) of this process and of its finished worker processes
+    def read(who):
+        usage = resource.getrusage(who)
+        # ru_maxrss is in KB on Linux and in bytes on macOS
+        peak = usage.ru_maxrss / (1024 * 1024) if sys.platform == "darwin" else usage.ru_maxrss / 1024
+        return peak, usage.ru_utime + usage.ru_stime
+    return read(resource.RUSAGE_SELF), read(resource.RUSAGE_CHILDREN)
+
+def _measure(stage, results, use_tracemalloc, func, *args, **kwargs):
+    """
+    Runs one stage and records its wall time, CPU time and memory.
+    Thumbnails and pages are rendered in worker processes, which neither tracemalloc nor the RSS of this process
+    see, so the CPU time and peak RSS of the workers are recorded separately. Peak RSS is a high-water mark over
+    the whole run, for this process as for its workers: the "growth" figures tell how much this stage raised it,
+    0 meaning the stage stayed below the peak of an earlier stage.
+    """
+    if use_tracemalloc:
+        tracemalloc.start()
+    before = _rusage() if resource is not None else None
+    wall, cpu = time.perf_counter(), time.process_time()
+    value = func(*args, **kwargs)
+    entry = {"seconds": time.perf_counter() - wall, "cpu_seconds": time.process_time() - cpu}
+    if before is not None:
+        (peak, _), (children_peak, children_cpu) = after = _rusage()
+        entry.update({"peak_rss_mb": peak, "rss_growth_mb": peak - before[0][0],
+                      "children_cpu_seconds": children_cpu - before[1][1],
+                      "children_peak_rss_mb": children_peak, "children_rss_growth_mb": children_peak - before[1][0]})
+    if use_tracemalloc:
+        entry["traced_peak_mb"] = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        tracemalloc.stop()
+    results[stage] = entry
+    print(f"  {stage}: {entry['seconds']:.2f}s")
+    return value
+
+def run_benchmark(n_files, workdir, stages=STAGES, n_templates=None, skew=1.1, demo_lines=25,
+                  render_mode="table", use_tracemalloc=True, max_workers=None):
+    """
+    Generates a synthetic tree of n_files leaf images and measures the selected stages on it.
+
+    Returns:
+        dict: The measurements of this scale.
+    """
+    root = os.path.join(workdir, f"tree_{n_files}")
+    shutil.rmtree(root, ignore_errors=True)
+    started = time.perf_counter()
+    src_dir, leaf_dir = generate_synthetic_tree(root, n_files, n_templates, skew)
+    result = {"files": n_files, "templates": len(os.listdir(leaf_dir)), "skew": skew,
+              "generate_seconds": time.perf_counter() - started, "stages": {}}
+    print(f"{n_files} files in {result['templates']} groups generated in {result['generate_seconds']:.1f}s")
+    stats = result["stages"]
+    demo.metrics.reset()
+
+    # The scan stage only lists the tree; the group stage also builds the template dictionaries
+    if "scan" in stages:
+        _measure("scan", stats, use_tracemalloc,
+                 lambda: (list(demo.scan_src_images(src_dir)), list(demo.scan_leaf_images(leaf_dir))))
+    src_group = _measure("group_src", stats, use_tracemalloc, demo.read_src_img, src_dir) if "group" in stages \
+        else demo.read_src_img(src_dir)
+    leaf_group = _measure("group", stats, use_tracemalloc, demo.read_leaf_img, leaf_dir) if "group" in stages \
+        else demo.read_leaf_img(leaf_dir)
+    group_sizes = sorted(len(paths) for paths in leaf_group.values())
+    result["largest_group"] = group_sizes[-1] if group_sizes else 0
+    result["median_group"] = group_sizes[len(group_sizes) // 2] if group_sizes else 0
+
+    thumbnails = None
+    if "thumbnails" in stages:
+        cache_dir = os.path.join(root, "cache", "thumbnails")
+        thumbnails = _measure("thumbnails", stats, use_tracemalloc, demo.build_thumbnail_cache,
+                              leaf_group, src_group, cache_dir, max_workers=max_workers)
+
+    if "html" in stages:
+        html_dir = os.path.join(root, "html")
+        _measure("html", stats, use_tracemalloc, demo.visualize_scratch_in_root,
+                 leaf_group, src_group, html_dir, demo_lines, thumbnails, render_mode=render_mode,
+                 max_workers=max_workers)
+        sizes = [os.path.getsize(os.path.join(html_dir, name)) for name in os.listdir(html_dir)
+                 if name.startswith("demo_batch_")]
+        result["pages"] = {"count": len(sizes), "total_bytes": sum(sizes),
+                           "max_bytes": max(sizes, default=0),
+                           "mean_bytes": sum(sizes) / len(sizes) if sizes else 0}
+    # Counters and sub-stage timings collected by the pipeline itself
+    result["pipeline"] = demo.metrics.as_dict()
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the demo_and_select_open_source.py pipeline on synthetic trees.")
+    parser.add_argument("--files", type=int, nargs="+", default=[1000, 10000], help="Leaf image counts to benchmark.")
+    parser.add_argument("--templates", type=int, default=None, help="Number of groups, defaults to files // 50.")
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent of the group sizes.")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--demo-lines", type=int, default=25)
+    parser.add_argument("--render-mode", choices=demo.RENDER_MODES, default="table")
+    parser.add_argument("--workers", type=int, default=None, help="Thumbnail and page worker processes.")
+    parser.add_argument("--workdir", default=None, help="Directory for the synthetic trees, a temporary one by default.")
+    parser.add_argument("--keep", action="store_true", help="Keep the synthetic trees.")
+    parser.add_argument("--no-tracemalloc", action="store_true", help="Skip tracemalloc, it slows large runs down.")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args(argv)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="demo_select_bench_")
+    # platform.platform() runs a subprocess, it is only called after the runs so it does not count as a worker
+    report = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+              "platform": None, "cpus": os.cpu_count(), "args": vars(args), "results": []}
+    try:
+        for n_files in args.files:
+            report["results"].append(run_benchmark(
+                n_files, workdir, args.stages, args.templates, args.skew, args.demo_lines,
+                args.render_mode, not args.no_tracemalloc, args.workers))
+            if not args.keep:
+                shutil.rmtree(os.path.join(workdir, f"tree_{n_files}"), ignore_errors=True)
+    finally:
+        if not args.keep and args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+    report["platform"] = platform.platform()
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"Benchmark results have been written to {args.output}")
+
+if __name__ == "__main__":
+    main()
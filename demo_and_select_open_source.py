@@ -21,10 +21,70 @@ Functions:
    - Generates HTML content to display images and their templates.
    - Includes interactive features for image selection and saving.
    - Returns the generated HTML content as a string.
+   - `iter_html_with_templates` yields the same page piece by piece, and `write_html_with_templates(file, ...)` streams it to an open file with bounded memory.
+   - Pages reference the shared `gallery.css`/`gallery.js`, which `write_gallery_assets(output_dir)` writes once per output directory.
+   - With `render_mode="virtual"`, `iter_virtual_html_with_templates` emits the batch as compact JSON, and the page only draws the rows in the viewport, keeping the selection in a JavaScript Set.
+   - With `render_mode="sprite"`, `build_sprite_sheets` packs the thumbnails of each row into one cached sprite sheet with an offset table, and the checkboxes map onto its cells; the original paths are still what gets saved.
 
 5. `visualize_scratch_in_root(folder_path, src_group, output_dir, demo_lines=25)`:
    - Processes images in subfolders of the given directory, grouping them by template names.
    - Generates and saves HTML files to the specified output directory, with each file containing a batch of images based on the specified number of templates per file.
+   - With `max_images`/`max_bytes`, `partition_batches` balances pages by image count and thumbnail bytes, splitting oversized templates across pages, and per-page cost stats are reported.
+
+6. `build_thumbnail_cache(leaf_group, src_group, cache_dir, leaf_size, src_size, max_workers=None)`:
+   - Renders downscaled copies of every leaf and source image on a process pool, using `resize_image`.
+   - Thumbnails are stored in a content-addressed cache directory, so unchanged images are never rendered twice.
+   - Returns a dictionary mapping original image paths to thumbnail paths, which can be passed to `visualize_scratch_in_root`.
+   - Images are loaded by `decode_image`: JPEGs use their embedded EXIF thumbnail when it is big enough, else `Image.draft` DCT scaling, and only fall back to a full decode; the path every image took is counted per format in the metrics.
+
+7. `load_manifest(manifest_path)` / `save_manifest(manifest, manifest_path)`:
+   - Load and save the incremental build manifest (path, size, mtime, thumbnail hash, batch assignment) next to the `json/` outputs.
+   - When passed to the functions above, only new or changed folders are listed, only new or changed images are thumbnailed, and only the batch pages whose contents changed are rewritten.
+
+8. `scan_leaf_images(folder_path, manifest=None, max_workers=16)` / `scan_src_images(folder_path, manifest=None)`:
+   - Stream `(template, path)` pairs using `os.scandir`, listing the `origin_*` subfolders concurrently on a thread pool.
+   - Only files with an extension in `IMAGE_EXTENSIONS` are kept; template names are parsed with `LEAF_NAME_PATTERN` / `SRC_NAME_PATTERN`.
+   - `read_leaf_img` and `read_src_img` group the pairs while the scan is still running.
+
+9. `serve(root_dir, host, port, pages_dir, store_path)` (`python demo_and_select_open_source.py serve`):
+   - Runs an asyncio HTTP server on localhost serving the batch pages, thumbnails and originals with caching headers and range support.
+   - Pages opened from it post debounced batches of selection changes, which `SelectionStore` appends to one shared store on disk.
+   - Only the pages, the image folders and the caches are served, and changes are only accepted as JSON from the server's own pages.
+
+10. `compute_perceptual_hashes(leaf_group, src_group)` / `find_near_duplicates(leaf_hashes, src_hashes, threshold)`:
+   - Compute 64-bit perceptual hashes in parallel, stored as packed uint64 NumPy arrays per template.
+   - Find near-duplicates within each template and against its source images with vectorized Hamming distances.
+   - Matches are pre-selected in the pages (`preselected`), and `export_selection_txt` writes them in the "Save Selected Images" txt format.
+
+11. `PipelineMetrics` / `metrics` (`--metrics json/metrics.json`, `--profile`):
+   - Times every stage (wall and CPU seconds) and counts scanned files, skipped and malformed names, built thumbnails and written pages.
+   - Records the bytes written per batch page and the peak RSS, and saves them as a JSON metrics file after each run.
+   - `--profile` also runs cProfile (`json/profile.pstats`) and tracemalloc, adding the top allocation sites to the metrics.
+
+12. `apply_selection_files(txt_paths, html_dir, action)` (`python demo_and_select_open_source.py apply`):
+   - `iter_selected_paths` streams and deduplicates the saved txt files, resolving their lines against the HTML directory.
+   - `apply_selection` deletes or quarantines the images in batches on a bounded thread pool, with a dry-run mode and a resumable journal.
+   - `forget_removed_images` drops them from the manifest and the saved groups, and only their folders are listed again by the next run.
+
+13. `save_group_index(image_groups, index_path)` / `load_group_index(index_path)`:
+   - Save the groups as a columnar binary index, a table of folder prefixes plus file name arrays, instead of indent=4 JSON.
+   - The loader memory-maps the file and returns a lazy `{template: [paths]}` mapping; `export_group_json` (`--export-json`) still writes the JSON.
+
+14. `GroupStore`:
+   - The memory-compact `{template: [paths]}` mapping returned by `read_leaf_img` and `read_src_img`, interning folder prefixes and packing file names into per-template arrays.
+   - `visualize_scratch_in_root` sorts it once in place and hands zero-copy `GroupPaths` slices of it to the HTML generator.
+
+15. `probe_images(leaf_group, src_group)` / `route_broken_images(leaf_group, probes)`:
+   - Read the size, format and mode of every image from its header on a thread pool, checking the JPEG EOI / PNG IEND / GIF trailer for truncation; results are cached in the manifest.
+   - Leaf images get their displayed `width`/`height` in the table markup, and corrupt files are moved to a pre-selected "broken" group.
+
+16. `watch(gallery)` (`python demo_and_select_open_source.py watch`):
+   - `FolderWatcher` reports the changed leaf and source folders in debounced batches, using inotify with a polling fallback.
+   - `LiveGallery` rescans only those folders, probes and thumbnails the new images and rewrites the affected pages; the review server pushes appended images to the open pages over server-sent events.
+
+17. `write_batch_index(stats, output_dir)`:
+   - `visualize_scratch_in_root` renders the changed batch pages on a process pool, each written to a temporary file and renamed into place, so a half-written page is never served.
+   - The summary page `index.html` lists every batch with its template range, group and image counts; the review server opens on it.
 
 Usage:
 1. Set the `src_folder_path` to the directory containing the images.
@@ -69,10 +129,70 @@ Attention:
    - 生成HTML内容以显示图像及其模板。
    - 包含图像选择和保存的交互功能。
    - 返回生成的HTML内容（字符串格式）。
+   - `iter_html_with_templates` 逐段生成同样的页面，`write_html_with_templates(file, ...)` 将其直接写入已打开的文件，内存占用有上限。
+   - 页面引用共享的 `gallery.css`/`gallery.js`，由 `write_gallery_assets(output_dir)` 在每个输出目录中写一次。
+   - 使用 `render_mode="virtual"` 时，`iter_virtual_html_with_templates` 以紧凑的 JSON 输出该批次，页面只渲染视口内的行，勾选状态保存在 JavaScript 的 Set 中。
+   - 使用 `render_mode="sprite"` 时，`build_sprite_sheets` 将每行的缩略图合并为一张带偏移表的缓存拼图，复选框对应拼图中的单元格；保存的仍是原图路径。
 
 5. `visualize_scratch_in_root(folder_path, src_group, output_dir, demo_lines=25)`：
    - 处理给定目录的子文件夹中的图像，并按模板名称将其分组。
    - 生成并保存HTML文件到指定的输出目录，每个文件包含一批图像，基于指定的每个文件模板数。
+   - 设置 `max_images`/`max_bytes` 后，`partition_batches` 按图片数量和缩略图字节数均衡各页面，超大的组会拆分到多个页面，并输出每页的开销统计。
+
+6. `build_thumbnail_cache(leaf_group, src_group, cache_dir, leaf_size, src_size, max_workers=None)`：
+   - 使用进程池和 `resize_image` 为所有叶子图像和源图像生成缩略图。
+   - 缩略图按文件内容哈希存放在缓存目录中，未变化的图像不会重复生成。
+   - 返回原图路径到缩略图路径的字典，可传给 `visualize_scratch_in_root`。
+   - 图片由 `decode_image` 读取：JPEG 优先使用足够大的 EXIF 内嵌缩略图，其次使用 `Image.draft` 的 DCT 缩放解码，最后才完整解码；每张图片所走的路径按格式统计在指标文件中。
+
+7. `load_manifest(manifest_path)` / `save_manifest(manifest, manifest_path)`：
+   - 读取和保存增量构建的 manifest（路径、大小、修改时间、缩略图哈希、所属批次），与 `json/` 输出放在一起。
+   - 传给上述函数后，只重新列出有变化的文件夹，只为新增或改动的图片生成缩略图，只重写内容有变化的批次页面。
+
+8. `scan_leaf_images(folder_path, manifest=None, max_workers=16)` / `scan_src_images(folder_path, manifest=None)`：
+   - 使用 `os.scandir` 流式输出 `(模板名, 路径)`，并用线程池并发遍历 `origin_*` 子文件夹。
+   - 只保留扩展名在 `IMAGE_EXTENSIONS` 中的文件；模板名由 `LEAF_NAME_PATTERN` / `SRC_NAME_PATTERN` 解析。
+   - `read_leaf_img` 和 `read_src_img` 在扫描的同时进行分组。
+
+9. `serve(root_dir, host, port, pages_dir, store_path)`（`python demo_and_select_open_source.py serve`）：
+   - 在本机运行 asyncio HTTP 服务器，提供批次页面、缩略图和原图，支持缓存头和 Range 请求。
+   - 从该服务器打开的页面会批量、延迟地提交勾选变化，由 `SelectionStore` 追加写入磁盘上共享的存储文件。
+   - 只提供页面、图片文件夹和缓存目录中的文件，且只接受来自本服务器页面的 JSON 勾选变化。
+
+10. `compute_perceptual_hashes(leaf_group, src_group)` / `find_near_duplicates(leaf_hashes, src_hashes, threshold)`：
+   - 并行计算64位感知哈希，按模板存为紧凑的 uint64 NumPy 数组。
+   - 使用向量化的汉明距离查找组内以及与源图近似重复的图片。
+   - 匹配结果在页面中预先勾选（`preselected`），`export_selection_txt` 将其导出为与保存按钮相同格式的txt。
+
+11. `PipelineMetrics` / `metrics`（`--metrics json/metrics.json`，`--profile`）：
+   - 记录每个阶段的耗时（墙钟和CPU秒数），并统计扫描的文件数、跳过和格式错误的文件名、生成的缩略图和写出的页面数。
+   - 记录每个批次页面写出的字节数和内存峰值（RSS），每次运行后保存为JSON指标文件。
+   - `--profile` 额外运行 cProfile（`json/profile.pstats`）和 tracemalloc，并将内存分配最多的位置加入指标文件。
+
+12. `apply_selection_files(txt_paths, html_dir, action)`（`python demo_and_select_open_source.py apply`）：
+   - `iter_selected_paths` 流式读取并去重保存的txt文件，按HTML目录解析其中的相对路径。
+   - `apply_selection` 使用有界线程池分批删除或隔离图片，支持试运行（dry-run）和可恢复的日志。
+   - `forget_removed_images` 将其从 manifest 和保存的分组中移除，下次运行只重新列出这些目录。
+
+13. `save_group_index(image_groups, index_path)` / `load_group_index(index_path)`：
+   - 将分组保存为列式二进制索引（文件夹前缀表 + 文件名数组），代替 indent=4 的JSON。
+   - 读取时通过 mmap 映射文件，返回惰性的 `{模板名: [路径]}` 映射；`export_group_json`（`--export-json`）仍可导出JSON。
+
+14. `GroupStore`：
+   - `read_leaf_img` 和 `read_src_img` 返回的紧凑 `{模板名: [路径]}` 映射，文件夹前缀只保存一次，文件名按模板打包存放在数组中。
+   - `visualize_scratch_in_root` 只对其原地排序一次，并将零拷贝的 `GroupPaths` 切片交给HTML生成函数。
+
+15. `probe_images(leaf_group, src_group)` / `route_broken_images(leaf_group, probes)`：
+   - 使用线程池只读取文件头，获取每张图片的尺寸、格式和模式，并检查 JPEG EOI / PNG IEND / GIF 结尾标记判断是否截断；结果缓存在 manifest 中。
+   - 表格中的叶子图片带有显示尺寸 `width`/`height`，损坏的文件归入预先勾选的 "broken" 组。
+
+16. `watch(gallery)`（`python demo_and_select_open_source.py watch`）：
+   - `FolderWatcher` 使用 inotify（不可用时轮询）监视叶子和源图目录，并将变化的目录合并成批报告。
+   - `LiveGallery` 只重新扫描这些目录，只对新图片读取文件头、生成缩略图并重写受影响的页面；审核服务器通过 server-sent events 将新增图片推送到已打开的页面。
+
+17. `write_batch_index(stats, output_dir)`：
+   - `visualize_scratch_in_root` 使用进程池并行生成有变化的批次页面，每个页面先写入临时文件再重命名到位，不会提供写了一半的页面。
+   - 汇总页 `index.html` 列出每个批次的模板范围、组数和图片数；审核服务器默认打开该页面。
 
 使用方法：
 1. 设置 `src_folder_path` 为包含图像的目录路径。
@@ -97,77 +217,771 @@ visualize_scratch_in_root(leaf_group, src_group, demo_dir_path, lines_per_file)
 """
 
 
+import io
 import os
 import re
+import sys
 import json
+import struct
+import select
+import ctypes
+import ctypes.util
+import mmap
+import array
+import html
+import time
+import queue
+import asyncio
+import shutil
+import hashlib
+import argparse
+import collections.abc
+import threading
+import pstats
+import cProfile
+import mimetypes
+import contextlib
+import tracemalloc
+import email.utils
+import urllib.parse
+from http import HTTPStatus
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
 from PIL import Image
 
-def read_src_img(folder_path):
+try:
+    import resource
+except ImportError:  # not available on Windows, peak RSS is then left out of the metrics
+    resource = None
+
+# Only files with these extensions are shown in the gallery
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp", ".tif", ".tiff"}
+
+# 可改：根据文件名或者路径划分可视化的组别，正则的第一个分组即为模板名
+# 这里假设源图文件名为"origin_1.jpg"，叶子图文件名为"origin_1_000.jpg"
+# To be customized: the first group of each pattern is the template name, matched against the file name without extension
+# Here, we assume source images are named like "origin_1.jpg" and leaf images like "origin_1_000.jpg"
+SRC_NAME_PATTERN = re.compile(r"origin_([^_]*)$")  # customized
+LEAF_NAME_PATTERN = re.compile(r"origin_([^_]*)_")  # customized
+
+# Folder listing is I/O bound, so it runs on threads; pairs are handed over in chunks to keep the queue cheap
+SCAN_WORKERS = 16
+SCAN_CHUNK_SIZE = 1024
+
+# Near-duplicate detection: 64-bit pHash of a 32x32 DCT, two images whose hashes differ in at most
+# PHASH_THRESHOLD bits are near-duplicates. Matches are pre-selected in the pages.
+# 近似重复检测：两张图片的感知哈希相差不超过 PHASH_THRESHOLD 位即视为近似重复，并在页面中预先勾选。
+PHASH_SIZE = 32
+PHASH_THRESHOLD = 6
+PHASH_BLOCK_SIZE = 2048
+
+# Selections posted by pages opened from the review server (`serve`) are appended here
+SELECTION_STORE_PATH = "json/selections.jsonl"
+SERVER_CHUNK_SIZE = 1 << 16
+SERVER_MAX_BODY = 16 << 20
+SERVER_IMAGE_DIRS = ("data/leaf", "data/src")  # image folders served next to the pages and the caches, relative to the root
+SSE_HEARTBEAT = 15.0  # seconds between keep-alive comments on an idle /api/events stream
+SSE_QUEUE_SIZE = 256  # events buffered per client, a client that stops reading misses the next ones
+
+# Watch mode: filesystem events are collected until none arrived for WATCH_DEBOUNCE seconds (at most WATCH_MAX_DELAY),
+# so a scraper writing many files triggers one update. Without inotify the folders are polled every WATCH_POLL_INTERVAL.
+# 监视模式：文件系统事件在 WATCH_DEBOUNCE 秒内没有新事件（最多 WATCH_MAX_DELAY 秒）后合并为一次更新；没有 inotify 时轮询。
+WATCH_DEBOUNCE = 0.5
+WATCH_MAX_DELAY = 5.0
+WATCH_POLL_INTERVAL = 2.0
+WATCH_SETTLE_SECONDS = 5.0  # an unreadable image modified more recently than this is still being written, retry it
+# inotify(7) flags
+_IN_NONBLOCK, _IN_CLOEXEC = 0o4000, 0o2000000
+_IN_CLOSE_WRITE, _IN_MOVED_FROM, _IN_MOVED_TO, _IN_CREATE, _IN_DELETE = 0x8, 0x40, 0x80, 0x100, 0x200
+_IN_DELETE_SELF, _IN_MOVE_SELF, _IN_Q_OVERFLOW, _IN_IGNORED, _IN_ISDIR = 0x400, 0x800, 0x4000, 0x8000, 0x40000000
+_IN_WATCH_MASK = (_IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF
+                  | _IN_MOVE_SELF)
+
+# Groups are saved as a compact binary index (folder table + file name arrays), JSON only with --export-json
+# 分组保存为紧凑的二进制索引（文件夹表 + 文件名数组），只有使用 --export-json 时才导出JSON
+GROUP_INDEX_MAGIC = b"DSGIDX01"
+LEAF_GROUP_INDEX_PATH = "json/leaf_group.idx"
+SRC_GROUP_INDEX_PATH = "json/src_group.idx"
+
+# `apply` deletes or quarantines the selected images, journaling every batch so an interrupted run can resume
+# `apply` 删除或隔离已勾选的图片，每批操作写入日志，中断后可以继续
+APPLY_ACTIONS = ("quarantine", "delete")
+APPLY_JOURNAL_PATH = "json/apply_journal.jsonl"
+QUARANTINE_DIR = "quarantine"
+APPLY_WORKERS = 8
+APPLY_BATCH_SIZE = 256
+GROUP_PATHS = (LEAF_GROUP_INDEX_PATH, SRC_GROUP_INDEX_PATH, "json/leaf_group.json", "json/src_group.json")
+
+# Thumbnails are what the browser actually decodes; the original path is still what gets selected and saved.
+# 缩略图仅用于浏览器显示，勾选和保存的仍然是原图路径。
+THUMBNAIL_CACHE_DIR = "cache/thumbnails"
+LEAF_THUMBNAIL_SIZE = (200, 200)  # matches the max-width/max-height of leaf images in the page
+SRC_THUMBNAIL_SIZE = (800, 800)  # matches the .src-image size in the page
+THUMBNAIL_VERSION = 2  # part of the cache keys, bumped when thumbnails of the same image change (2: EXIF orientation)
+# Header-only probe of every image: its size goes into the markup, and truncated or unreadable files are
+# gathered in a pre-selected BROKEN_TEMPLATE group
+# 只读取文件头探测每张图片：尺寸写入页面，截断或无法读取的图片归入预先勾选的 BROKEN_TEMPLATE 组
+PROBE_WORKERS = 16
+PROBE_TAIL_SIZE = 1024
+PROBE_VERSION = 2  # bumped when probes of the same image change, cached probes are then read again (2: EXIF orientation)
+BROKEN_TEMPLATE = "broken"
+_IMAGE_TRAILERS = {"JPEG": b"\xff\xd9", "PNG": b"IEND\xaeB`\x82", "GIF": b"\x3b"}
+# "fast" decodes JPEGs from their EXIF thumbnail or at a reduced scale, "full" always decodes them fully, see `decode_image`
+THUMBNAIL_DECODER = "fast"
+# With render_mode="sprite", the leaf thumbnails of a row are packed into one sheet, so a row costs one request
+# 使用 render_mode="sprite" 时，每行的叶子缩略图合并为一张拼图，每行只需一次请求
+SPRITE_CACHE_DIR = "cache/sprites"
+SPRITE_MAX_WIDTH = 2048
+SPRITE_MAX_CELLS = 256
+
+# Batch pages are rendered on a process pool (None: one process per CPU) and renamed into place once complete;
+# BATCH_INDEX_PAGE links every batch with its template range and image count
+# 批次页面由进程池并行生成（None 表示每个CPU一个进程），写完后再重命名到位；BATCH_INDEX_PAGE 汇总列出所有批次
+PAGE_WORKERS = None
+BATCH_INDEX_PAGE = "index.html"
+
+# The manifest remembers what the previous run scanned, rendered and wrote, so re-runs only redo what changed.
+# manifest 记录上一次运行扫描、生成和写出的内容，重新运行时只处理有变化的部分。
+MANIFEST_PATH = "json/manifest.json"
+# Per-stage timings and counters of a run, see `PipelineMetrics`; --profile adds cProfile and tracemalloc
+METRICS_PATH = "json/metrics.json"
+PROFILE_PATH = "json/profile.pstats"
+
+# Pages rendered by a different version of this script are always rewritten
+with open(__file__, "rb") as _f:
+    _GENERATOR_VERSION = hashlib.sha1(_f.read()).hexdigest()
+
+class PipelineMetrics:
+    """
+    Timings and counters of one pipeline run.
+    Stages are timed with `with metrics.stage(name):`, counters are incremented with `metrics.count(name, n)`,
+    and `save` writes everything, with the peak RSS, as a JSON metrics file.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
+        self.stages = {}  # name -> {"seconds", "cpu_seconds", "calls"}
+        self.counters = {}
+        self.batches = {}  # page -> bytes written
+        self.decoders = {}  # format -> decode path -> {"images", "seconds"}
+        self.extra = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            with self._lock:
+                entry = self.stages.setdefault(name, {"seconds": 0.0, "cpu_seconds": 0.0, "calls": 0})
+                entry["seconds"] += time.perf_counter() - wall
+                entry["cpu_seconds"] += time.process_time() - cpu
+                entry["calls"] += 1
+
+    def count(self, name, n=1):
+        # Called from scanner threads too, so the update is locked; hot loops count locally and add once
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def record_batch(self, page, bytes_written):
+        with self._lock:
+            self.batches[page] = bytes_written
+
+    def record_decode(self, image_format, path, seconds):
+        with self._lock:
+            entry = self.decoders.setdefault(image_format or "unknown", {}).setdefault(path, {"images": 0, "seconds": 0.0})
+            entry["images"] += 1
+            entry["seconds"] += seconds
+
+    def as_dict(self):
+        result = {
+            "started": self.started,
+            "seconds": time.time() - self.started,
+            "stages": self.stages,
+            "counters": self.counters,
+            "batches": self.batches,
+            "decoders": self.decoders,
+            "bytes_written": sum(self.batches.values()),
+        }
+        if resource is not None:
+            # ru_maxrss is in KB on Linux and in bytes on macOS; children are the thumbnail/hash worker processes
+            scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+            result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+            result["peak_rss_children_mb"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+        result.update(self.extra)
+        return result
+
+    def save(self, metrics_path=METRICS_PATH):
+        os.makedirs(os.path.dirname(metrics_path) or ".", exist_ok=True)
+        with open(metrics_path, "w") as f:
+            json.dump(self.as_dict(), f, indent=4)
+        print(f"Metrics have been written to {metrics_path}")
+
+# Metrics of the current run, shared by the pipeline functions below
+metrics = PipelineMetrics()
+
+def start_profiling():
+    """
+    Starts cProfile and tracemalloc for the `--profile` mode.
+
+    Returns:
+        cProfile.Profile: The running profiler, to be passed to `stop_profiling`.
+    """
+    tracemalloc.start()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+def stop_profiling(profiler, profile_path=PROFILE_PATH, top=20):
+    """
+    Stops the profilers started by `start_profiling`, saves the cProfile stats and records the
+    tracemalloc peak and largest allocation sites in `metrics`.
+
+    Parameters:
+        profiler (cProfile.Profile): The profiler returned by `start_profiling`.
+        profile_path (str): The path of the pstats file, readable with `python -m pstats`.
+        top (int): The number of functions and allocation sites reported.
+    """
+    profiler.disable()
+    snapshot = tracemalloc.take_snapshot()
+    traced_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    os.makedirs(os.path.dirname(profile_path) or ".", exist_ok=True)
+    profiler.dump_stats(profile_path)
+    pstats.Stats(profiler).sort_stats("cumulative").print_stats(top)
+    print(f"cProfile stats have been written to {profile_path}")
+    metrics.extra["profile_path"] = profile_path
+    metrics.extra["traced_peak_mb"] = traced_peak / (1024 * 1024)
+    metrics.extra["top_allocations"] = [
+        {"site": str(stat.traceback), "size_mb": stat.size / (1024 * 1024), "count": stat.count}
+        for stat in snapshot.statistics("lineno")[:top]
+    ]
+
+def load_manifest(manifest_path=MANIFEST_PATH):
+    """
+    Loads the incremental build manifest written by a previous run.
+
+    Parameters:
+        manifest_path (str): The path to the manifest file.
+
+    Returns:
+        dict: The manifest, or an empty manifest if the file does not exist or cannot be parsed.
+    """
+    manifest = {"files": {}, "dirs": {}, "pages": {}}
+    if manifest_path is None or not os.path.exists(manifest_path):
+        return manifest
+    try:
+        with open(manifest_path, "r") as f:
+            manifest.update(json.load(f))
+    except (OSError, ValueError) as e:
+        print(f"Error: Manifest {manifest_path} cannot be read, rebuilding from scratch: {e}")
+    return manifest
+
+def save_manifest(manifest, manifest_path=MANIFEST_PATH):
+    """
+    Saves the incremental build manifest.
+
+    Parameters:
+        manifest (dict): The manifest to save.
+        manifest_path (str): The path to the manifest file.
+    """
+    os.makedirs(os.path.dirname(manifest_path) or ".", exist_ok=True)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, separators=(",", ":"))
+    os.replace(tmp_path, manifest_path)
+
+def _iter_dir_entries(dir_path, manifest=None):
+    """
+    Lazily yields the entries of a folder, using the type information of `os.scandir` instead of one stat per entry.
+    A folder's mtime only changes when entries are added, removed or renamed,
+    so with a manifest an unchanged folder replays the listing stored by the previous run.
+
+    Parameters:
+        dir_path (str): The path to the folder.
+        manifest (dict): Optional manifest, see `load_manifest`.
+
+    Yields:
+        tuple: (name, is_dir) of every entry in the folder.
+    """
+    if manifest is not None:
+        mtime = os.stat(dir_path).st_mtime_ns
+        cached = manifest["dirs"].get(dir_path)
+        if cached is not None and cached.get("mtime") == mtime and "subdirs" in cached:
+            for name in cached["subdirs"]:
+                yield name, True
+            for name in cached["files"]:
+                yield name, False
+            metrics.count("folders_from_manifest")
+            return
+    files, subdirs = [], []
+    with os.scandir(dir_path) as it:
+        for entry in it:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                continue
+            (subdirs if is_dir else files).append(entry.name)
+            yield entry.name, is_dir
+    # Only a complete listing is remembered
+    if manifest is not None:
+        manifest["dirs"][dir_path] = {"mtime": mtime, "files": files, "subdirs": subdirs}
+
+def _scan_image_folder(dir_path, name_pattern, manifest=None):
+    # Yields (template, path) for the images of one folder whose names match name_pattern
+    scanned = skipped = malformed = 0
+    try:
+        for filename, is_dir in _iter_dir_entries(dir_path, manifest):
+            if is_dir:
+                continue
+            scanned += 1
+            stem, ext = os.path.splitext(filename)
+            if not filename.startswith("origin_") or ext.lower() not in IMAGE_EXTENSIONS:
+                skipped += 1
+                continue
+            match = name_pattern.match(stem)
+            if match is None:
+                malformed += 1
+                print(f"Error: File name {filename} is not in the correct format.")
+                continue
+            yield match.group(1), os.path.join(dir_path, filename)
+    finally:
+        metrics.count("folders_scanned")
+        metrics.count("files_scanned", scanned)
+        metrics.count("files_skipped", skipped)
+        metrics.count("malformed_names", malformed)
+
+def scan_src_images(folder_path, manifest=None):
+    """
+    Streams the source images of the specified folder.
+
+    Parameters:
+        folder_path (str): The path to the folder containing the images.
+        manifest (dict): Optional manifest, see `load_manifest`. Unchanged folders are not listed again.
+
+    Yields:
+        tuple: (template, path) of every source image, as soon as it is listed.
+    """
+    yield from _scan_image_folder(folder_path, SRC_NAME_PATTERN, manifest)
+
+def scan_leaf_images(folder_path, manifest=None, max_workers=SCAN_WORKERS):
+    """
+    Streams the leaf images of the specified folder, walking its `origin_*` subfolders concurrently on a thread pool.
+    Listing subfolders is I/O bound (especially on network storage), so threads overlap the waiting.
+
+    Parameters:
+        folder_path (str): The path to the folder containing subfolders with images.
+        manifest (dict): Optional manifest, see `load_manifest`. Unchanged folders are not listed again.
+        max_workers (int): The number of folders listed at the same time.
+
+    Yields:
+        tuple: (template, path) of every leaf image, in chunks as the subfolders are listed.
+    """
+    subfolders = [os.path.join(folder_path, name) for name, is_dir in _iter_dir_entries(folder_path, manifest)
+                  if is_dir and name.startswith("origin_")]
+    results = queue.Queue(maxsize=max_workers * 4)
+    stop = threading.Event()
+
+    def scan(subfolder_path):
+        chunk = []
+        try:
+            for pair in _scan_image_folder(subfolder_path, LEAF_NAME_PATTERN, manifest):
+                chunk.append(pair)
+                if len(chunk) >= SCAN_CHUNK_SIZE:
+                    results.put(chunk)
+                    chunk = []
+                    if stop.is_set():
+                        return
+        except OSError as e:
+            print(f"Error: Failed to list {subfolder_path}: {e}")
+        if chunk:
+            results.put(chunk)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(scan, path) for path in subfolders]
+        done = threading.Thread(target=lambda: (wait(futures), results.put(None)), daemon=True)
+        done.start()
+        try:
+            while True:
+                chunk = results.get()
+                if chunk is None:
+                    break
+                yield from chunk
+        finally:
+            # The consumer stopped early: let the workers finish their current chunk and drain the queue
+            stop.set()
+            for future in futures:
+                future.cancel()
+            while done.is_alive():
+                try:
+                    results.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+class _GroupColumns:
+    # The images of one template: a folder id and a UTF-8 file name per image, packed into arrays
+    __slots__ = ("dirs", "dir_ids", "names", "name_offsets", "sorted")
+
+    def __init__(self, dirs):
+        self.dirs = dirs
+        self.dir_ids = array.array("I")
+        self.names = bytearray()
+        self.name_offsets = array.array("Q", [0])
+        self.sorted = True
+
+    def __len__(self):
+        return len(self.dir_ids)
+
+    def append(self, dir_id, name):
+        self.dir_ids.append(dir_id)
+        self.names += name.encode("utf-8")
+        self.name_offsets.append(len(self.names))
+        self.sorted = False
+
+    def path(self, i):
+        return self.dirs[self.dir_ids[i]] + self.names[self.name_offsets[i]:self.name_offsets[i + 1]].decode("utf-8")
+
+    def sort(self):
+        # Ordered by folder, then by UTF-8 file name (the same order as the decoded names), without decoding any path
+        if self.sorted:
+            return
+        names, name_offsets, dir_ids = self.names, self.name_offsets, self.dir_ids
+        if len(set(dir_ids)) == 1:
+            order = sorted(range(len(self)), key=lambda i: names[name_offsets[i]:name_offsets[i + 1]])
+        else:
+            dir_rank = {dir_id: rank for rank, dir_id in enumerate(sorted(set(dir_ids), key=self.dirs.__getitem__))}
+            order = sorted(range(len(self)),
+                           key=lambda i: (dir_rank[dir_ids[i]], names[name_offsets[i]:name_offsets[i + 1]]))
+        dir_ids, names, name_offsets = array.array("I"), bytearray(), array.array("Q", [0])
+        for i in order:
+            dir_ids.append(self.dir_ids[i])
+            names += self.names[self.name_offsets[i]:self.name_offsets[i + 1]]
+            name_offsets.append(len(names))
+        self.dir_ids, self.names, self.name_offsets = dir_ids, names, name_offsets
+        self.sorted = True
+
+class GroupStore(collections.abc.Mapping):
+    """
+    Memory-compact {template: [paths]} mapping returned by `read_leaf_img` and `read_src_img`.
+    Folder prefixes are interned once in a table, and every image only keeps a folder id and its UTF-8 file name in
+    per-template arrays instead of a full path string in a list. Values are `GroupPaths` views decoding paths on access,
+    so the per-batch slices taken by `visualize_scratch_in_root` do not copy anything.
+    """
+
+    def __init__(self, pairs=()):
+        self._dirs = []  # folder prefixes, ending with a separator
+        self._dir_ids = {}
+        self._groups = {}  # template -> _GroupColumns
+        for template, path in pairs:
+            self.add(template, path)
+
+    def add(self, template, path):
+        """
+        Appends an image to a template.
+
+        Parameters:
+            template (str): The template name.
+            path (str): The image path.
+        """
+        name = os.path.basename(path)
+        prefix = path[:len(path) - len(name)]
+        dir_id = self._dir_ids.get(prefix)
+        if dir_id is None:
+            dir_id = self._dir_ids[prefix] = len(self._dirs)
+            self._dirs.append(prefix)
+        columns = self._groups.get(template)
+        if columns is None:
+            columns = self._groups[template] = _GroupColumns(self._dirs)
+        columns.append(dir_id, name)
+
+    def discard(self, template, paths):
+        """
+        Removes images from a template, the template is dropped once it is empty.
+
+        Parameters:
+            template (str): The template name.
+            paths (set): The image paths to remove, paths that are not in the template are ignored.
+
+        Returns:
+            int: The number of images removed.
+        """
+        columns = self._groups.get(template)
+        if columns is None:
+            return 0
+        kept = _GroupColumns(self._dirs)
+        for i in range(len(columns)):
+            if columns.path(i) not in paths:
+                name = columns.names[columns.name_offsets[i]:columns.name_offsets[i + 1]].decode("utf-8")
+                kept.append(columns.dir_ids[i], name)
+        if len(kept) == len(columns):
+            return 0
+        kept.sorted = columns.sorted
+        if len(kept):
+            self._groups[template] = kept
+        else:
+            del self._groups[template]
+        return len(columns) - len(kept)
+
+    def sort(self):
+        """
+        Sorts the images of every template by folder, then by file name, in place. Templates that did not change
+        since they were last sorted are skipped, so calling it again is cheap.
+        """
+        for columns in self._groups.values():
+            columns.sort()
+
+    def __getitem__(self, template):
+        columns = self._groups[template]
+        return GroupPaths(columns, 0, len(columns))
+
+    def __iter__(self):
+        return iter(self._groups)
+
+    def __len__(self):
+        return len(self._groups)
+
+    def __repr__(self):
+        return f"GroupStore({len(self)} templates, {sum(map(len, self._groups.values()))} images)"
+
+    def to_dict(self):
+        # Plain {template: [paths]} dictionary
+        return {template: list(paths) for template, paths in self.items()}
+
+def _group_images(pairs):
+    return GroupStore(pairs)
+
+def read_src_img(folder_path, manifest=None):
     """
     Reads images from the specified folder and groups them by their template names.
     
     Parameters:
         folder_path (str): The path to the folder containing the images.
+        manifest (dict): Optional manifest, see `load_manifest`. Unchanged folders are not listed again.
         
     Returns:
-        dict: A dictionary where keys are template names and values are lists of image file paths.
+        GroupStore: A mapping where keys are template names and values are lists of image file paths.
     """
     if folder_path is None or not os.path.exists(folder_path):
-        return {}
-    image_groups = {}
-    # Traverse the directory and collect images
-    for filename in os.listdir(folder_path):
-        if not filename.startswith("origin_"):
-            continue
-        # 可改：根据文件名或者路径划分可视化的组别
-        # 这里假设文件名以"origin_"开头，后面跟着模板名，如"origin_1.jpg"
-        # image_groups = {"1": "/origin_1_1.jpg" ,...}
-        # To be customized: Group images dict are classified based on file names or paths
-        # Here, we assume that the file name starts with "origin_" and followed by the template name, such as "origin_1.jpg"
-
-        parts = os.path.splitext(filename)[0].split('_')
-        if len(parts) != 2:# customized
-            print(f"Error: File name {filename} is not in the correct format.")
-            continue
-
-        template = parts[1] # customized
-        file_path = os.path.join(folder_path, filename)
-        if template not in image_groups:
-            image_groups[template] = []
-        image_groups[template].append(file_path)
-    return image_groups
+        return GroupStore()
+    return _group_images(scan_src_images(folder_path, manifest))
 
-def read_leaf_img(folder_path):
+def read_leaf_img(folder_path, manifest=None):
     """
     Reads images from the specified folder and groups them by their template names.
+    Images are grouped while the subfolders are still being listed, see `scan_leaf_images`.
     
     Parameters:
         folder_path (str): The path to the folder containing the images.
+        manifest (dict): Optional manifest, see `load_manifest`. Unchanged folders are not listed again.
         
     Returns:
-        dict: A dictionary where keys are template names and values are lists of image file paths.
+        GroupStore: A mapping where keys are template names and values are lists of image file paths.
     """
-    # Collect all image paths
-    image_groups = {}
-    
-    # Traverse the folder
-    for subfolder in os.listdir(folder_path):
-        subfolder_path = os.path.join(folder_path, subfolder)
-        if not os.path.isdir(subfolder_path) or not subfolder.startswith("origin_"):
-            continue
-        for filename in os.listdir(subfolder_path):
-            if not filename.startswith("origin_"):
-                continue
-            parts = filename.split('_')
-            if len(parts) < 3: # customized
-                print(f"Error: File name {filename} is not in the correct format.")
-                continue
-            template = parts[1] # customized
-            file_path = os.path.join(subfolder_path, filename)
-            if template not in image_groups:
-                image_groups[template] = []
-            image_groups[template].append(file_path)
-    return image_groups
+    return _group_images(scan_leaf_images(folder_path, manifest))
+
+def save_group_index(image_groups, index_path):
+    """
+    Saves image groups as a compact binary index instead of indent=4 JSON.
+    Folder prefixes are stored once in a table, and each image only keeps a folder id and its file name. The layout is
+    columnar and little-endian, so `load_group_index` can map it without parsing:
+
+        header              GROUP_INDEX_MAGIC, then n_dirs, n_templates, n_files and the three blob sizes (uint64)
+        dir_offsets         uint64[n_dirs + 1]       into the folder blob
+        template_offsets    uint64[n_templates + 1]  into the template name blob
+        template_starts     uint64[n_templates + 1]  first file of every template
+        name_offsets        uint64[n_files + 1]      into the file name blob
+        file_dirs           uint32[n_files]          folder id of every file, padded to 8 bytes
+        blobs               UTF-8 folder prefixes (ending with a separator), template names, file names
+
+    Parameters:
+        image_groups (dict): A dictionary of image paths grouped by their templates, e.g. from `read_leaf_img`.
+        index_path (str): The path to the index file.
+    """
+    dir_ids = {}
+    template_blob, name_blob = bytearray(), bytearray()
+    template_offsets, template_starts = array.array("Q", [0]), array.array("Q", [0])
+    name_offsets, file_dirs = array.array("Q", [0]), array.array("I")
+    for template, paths in image_groups.items():
+        template_blob += str(template).encode("utf-8")
+        template_offsets.append(len(template_blob))
+        for path in paths:
+            name = os.path.basename(path)
+            prefix = path[:len(path) - len(name)]
+            dir_id = dir_ids.get(prefix)
+            if dir_id is None:
+                dir_id = dir_ids[prefix] = len(dir_ids)
+            file_dirs.append(dir_id)
+            name_blob += name.encode("utf-8")
+            name_offsets.append(len(name_blob))
+        template_starts.append(len(file_dirs))
+    dir_blob = bytearray()
+    dir_offsets = array.array("Q", [0])
+    for prefix in dir_ids:
+        dir_blob += prefix.encode("utf-8")
+        dir_offsets.append(len(dir_blob))
+
+    if sys.byteorder != "little":
+        for column in (template_offsets, template_starts, name_offsets, file_dirs, dir_offsets):
+            column.byteswap()
+    header = np.array([len(dir_ids), len(template_offsets) - 1, len(file_dirs), len(dir_blob), len(template_blob),
+                       len(name_blob)], dtype="<u8")
+    os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(GROUP_INDEX_MAGIC)
+        f.write(header.tobytes())
+        for column in (dir_offsets, template_offsets, template_starts, name_offsets, file_dirs):
+            f.write(column.tobytes())
+        f.write(b"\0" * (4 * (len(file_dirs) % 2)))
+        f.write(dir_blob)
+        f.write(template_blob)
+        f.write(name_blob)
+    os.replace(tmp_path, index_path)
+
+class GroupPaths(collections.abc.Sequence):
+    """
+    Lazy, read-only list of the image paths of one template in a `GroupStore` or a `GroupIndex`.
+    Paths are decoded from the packed columns when accessed, and slicing returns another view without copying.
+    """
+    __slots__ = ("_index", "_start", "_stop")
+
+    def __init__(self, index, start, stop):
+        # index is anything with a path(i) method, i counting from the start of its columns
+        self._index = index
+        self._start = start
+        self._stop = stop
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(len(self))
+            if step == 1:
+                return GroupPaths(self._index, self._start + start, self._start + max(start, stop))
+            return [self[i] for i in range(start, stop, step)]
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError("group index out of range")
+        return self._index.path(self._start + item)
+
+    def __iter__(self):
+        path = self._index.path
+        for i in range(self._start, self._stop):
+            yield path(i)
+
+    def __repr__(self):
+        return f"GroupPaths({list(self)!r})"
+
+class GroupIndex(collections.abc.Mapping):
+    """
+    Read-only {template: [paths]} view of a group index written by `save_group_index`.
+    The file is memory-mapped: only the folder and template tables are decoded when it is opened,
+    image paths are decoded on access, see `GroupPaths`.
+    """
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        with open(index_path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(GROUP_INDEX_MAGIC)] != GROUP_INDEX_MAGIC:
+            self._mmap.close()
+            raise ValueError(f"{index_path} is not a group index")
+        offset = len(GROUP_INDEX_MAGIC)
+        n_dirs, n_templates, n_files, dir_size, template_size, name_size = (
+            int(n) for n in np.frombuffer(self._mmap, dtype="<u8", count=6, offset=offset))
+        offset += 6 * 8
+
+        def column(dtype, count):
+            nonlocal offset
+            values = np.frombuffer(self._mmap, dtype=dtype, count=count, offset=offset)
+            offset += values.nbytes
+            return values
+
+        dir_offsets = column("<u8", n_dirs + 1)
+        template_offsets = column("<u8", n_templates + 1)
+        self._template_starts = column("<u8", n_templates + 1)
+        self._name_offsets = column("<u8", n_files + 1)
+        self._file_dirs = column("<u4", n_files)
+        offset += 4 * (n_files % 2)
+
+        def strings(offsets, size):
+            nonlocal offset
+            blob = self._mmap[offset:offset + size]
+            offset += size
+            return [blob[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+
+        self._dirs = strings(dir_offsets, dir_size)
+        self._templates = {template: i for i, template in enumerate(strings(template_offsets, template_size))}
+        self._names_start = offset
+
+    def _check_open(self):
+        # Views handed out by __getitem__ can outlive the mapping
+        if self._name_offsets is None:
+            raise ValueError("group index is closed")
+
+    def path(self, i):
+        # Full path of the i-th image of the index
+        self._check_open()
+        start = self._names_start + int(self._name_offsets[i])
+        stop = self._names_start + int(self._name_offsets[i + 1])
+        return self._dirs[self._file_dirs[i]] + self._mmap[start:stop].decode("utf-8")
+
+    def __getitem__(self, template):
+        i = self._templates[template]
+        self._check_open()
+        return GroupPaths(self, int(self._template_starts[i]), int(self._template_starts[i + 1]))
+
+    def __iter__(self):
+        return iter(self._templates)
+
+    def __len__(self):
+        return len(self._templates)
+
+    def to_dict(self):
+        # Plain {template: [paths]} dictionary, e.g. for `export_group_json`
+        return {template: list(paths) for template, paths in self.items()}
+
+    def close(self):
+        # The NumPy columns share the mapped buffer, they are dropped before it is unmapped
+        self._template_starts = self._name_offsets = self._file_dirs = None
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def load_group_index(index_path):
+    """
+    Opens a group index written by `save_group_index`.
+
+    Parameters:
+        index_path (str): The path to the index file.
+
+    Returns:
+        GroupIndex: A lazy {template: [paths]} mapping over the memory-mapped file.
+    """
+    return GroupIndex(index_path)
+
+def export_group_json(image_groups, json_path):
+    """
+    Exports image groups as indented JSON, the format written by earlier versions of this script.
+
+    Parameters:
+        image_groups (dict): A dictionary of image paths grouped by their templates, or a `GroupIndex`.
+        json_path (str): The path to the JSON file.
+    """
+    os.makedirs(os.path.dirname(json_path) or ".", exist_ok=True)
+    with open(json_path, "w") as f:
+        json.dump({template: list(paths) for template, paths in image_groups.items()}, f, indent=4)
 
 def resize_image(image, size):
     # 可视化图片前先缩放，否则可视化效果不好
@@ -183,357 +997,3380 @@ def resize_image(image, size):
     """
     return image.resize(size, Image.Resampling.LANCZOS)
 
-def generate_html_with_templates(image_groups, src_group, index, demo_dir_path):
+def _parse_exif_thumbnail(exif):
     """
-    Generates HTML content for displaying images and their templates.
-    
+    Extracts the JPEG thumbnail embedded in IFD1 of raw EXIF data, without decoding anything.
+
     Parameters:
-        image_groups (dict): A dictionary of grouped images by their templates.
-        src_group (dict): A dictionary of source images grouped by their templates.
-        index (int): The index of the current batch of images.
-        demo_dir_path (str): The directory path where the HTML file will be saved.
-        
+        exif (bytes): The APP1 EXIF payload of a JPEG, with or without its "Exif\\0\\0" prefix.
+
     Returns:
-        str: The generated HTML content.
-    """
-    html_template = """
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Image Gallery</title>
-        <style>
-            table {{
-                width: 100%;
-                border-collapse: collapse;
-                font-size: 14px;
-            }}
-            th, td {{
-                border: 1px solid black;
-                padding: 7px;
-                text-align: center;
-            }}
-            img {{
-                max-width: 200px;
-                max-height: 200px;
-                margin: 5px;
-                cursor: pointer;
-            }}
-            .checkbox-container {{
-                display: inline-block;
-                align-items: center;
-                cursor: pointer;
-                position: relative;
-                border: 2px solid transparent; /* 默认边框透明 */
-            }}
-            .checkbox-container input {{
-                margin-right: 5px;
-            }}
-            .checkbox-container input:checked + img {{
-                border: 2px solid red; /* 选中时边框为红色 */
-            }}
-            .selection-box {{
-                border: 1px dashed #000;
-                position: absolute;
-                z-index: 1000;
-                background: rgba(0, 0, 0, 0.1);
-            }}
-            .top-right-button {{
-                position: fixed;
-                top: 10px;
-                right: 10px;
-                padding: 10px 20px;
-                background-color: #4CAF50;
-                color: white;
-                border: none;
-                cursor: pointer;
-                font-size: 16px;
-            }}
-            .top-left-button {{
-                position: fixed;
-                top: 10px;
-                left: 10px;
-                padding: 10px 20px;
-                background-color: red;
-                color: white;
-                border: none;
-                cursor: pointer;
-                font-size: 16px;
-            }}
-            .src-image {{
-                width: 800px;
-                height: 800px;
-                margin: 5px;
-                cursor: pointer;
-            }}
-            .highlight {{
-                border: 2px solid red; /* 高亮时边框为红色 */
-            }}
-        </style>
-        <script>
-            let isSelecting = false;
-            let startX, startY;
-            let selectionBox;
-            let checkboxes = [];
-
-            document.addEventListener('DOMContentLoaded', (event) => {{
-                const containers = document.querySelectorAll('.checkbox-container');
-
-                containers.forEach(container => {{
-                    container.addEventListener('click', (e) => {{
-                        if (!isSelecting) {{
-                            toggleCheckbox(container);
-                        }}
-                    }});
-                }});
-
-                document.addEventListener('mousedown', (e) => {{
-                    if (e.target.classList.contains('checkbox-container') || e.target.closest('.checkbox-container')) {{
-                        isSelecting = true;
-                        startX = e.pageX;
-                        startY = e.pageY;
-                        selectionBox = document.createElement('div');
-                        selectionBox.className = 'selection-box';
-                        selectionBox.style.left = startX + 'px';
-                        selectionBox.style.top = startY + 'px';
-                        document.body.appendChild(selectionBox);
-                        checkboxes = Array.from(containers).map(container => container.querySelector('input[type="checkbox"]'));
-                    }}
-                }});
-
-                document.addEventListener('mousemove', (e) => {{
-                    if (isSelecting) {{
-                        const currentX = e.pageX;
-                        const currentY = e.pageY;
-                        const width = Math.abs(currentX - startX);
-                        const height = Math.abs(currentY - startY);
-                        selectionBox.style.width = width + 'px';
-                        selectionBox.style.height = height + 'px';
-                        selectionBox.style.left = Math.min(startX, currentX) + 'px';
-                        selectionBox.style.top = Math.min(startY, currentY) + 'px';
-                    }}
-                }});
-
-                document.addEventListener('mouseup', (e) => {{
-                    if (isSelecting) {{
-                        isSelecting = false;
-                        const rect = selectionBox.getBoundingClientRect();
-                        checkboxes.forEach(checkbox => {{
-                            const boxRect = checkbox.closest('.checkbox-container').getBoundingClientRect();
-                            if (
-                                boxRect.left < rect.right &&
-                                boxRect.right > rect.left &&
-                                boxRect.top < rect.bottom &&
-                                boxRect.bottom > rect.top
-                            ) {{
-                                checkbox.checked = !checkbox.checked;
-                                updateCheckboxStyle(checkbox);
-                            }}
-                        }});
-                        selectionBox.parentNode.removeChild(selectionBox);
-                    }}
-                }});
-
-                document.getElementById('save-button').addEventListener('click', saveSelectedImages);
-                document.getElementById('load-button').addEventListener('click', loadSelectedTxt);
-
-                document.addEventListener('keydown', (e) => {{
-                    if (e.ctrlKey && e.key === 's') {{
-                        e.preventDefault();
-                        saveSelectedImages();
-                    }}
-                    if (e.ctrlKey && e.key === 'l') {{
-                        e.preventDefault();
-                        loadSelectedTxt();
-                    }}
-                }});
-            }});
-
-            function toggleCheckbox(container) {{
-                const checkbox = container.querySelector('input[type="checkbox"]');
-                checkbox.checked = !checkbox.checked;
-                updateCheckboxStyle(checkbox);
-            }}
-
-            function updateCheckboxStyle(checkbox) {{
-                const container = checkbox.closest('.checkbox-container');
-                if (checkbox.checked) {{
-                    container.style.border = '2px solid red';
-                }} else {{
-                    container.style.border = '2px solid transparent';
-                }}
-            }}
-
-
-            function saveSelectedImages() {{
-                const selectedImages = [];
-                const checkboxes = document.querySelectorAll('.checkbox-container input[type="checkbox"]:checked');
-                checkboxes.forEach(checkbox => {{
-                    const img = checkbox.nextElementSibling;
-                    const imgUrl = img.src;
-
-                    // 获取当前页面的基本 URL (协议 + 主机名 + 端口号)
-                    const baseUrl = window.location.origin;
-
-                    // 使用 baseUrl 来计算相对路径
-                    const relativePath = imgUrl.replace(baseUrl + '/', '');
-
-                    selectedImages.push(relativePath);
-                }});
-
-
-                const blob = new Blob([selectedImages.join('\\n')], {{ type: 'text/plain' }});
-                const url = URL.createObjectURL(blob);
-                const a = document.createElement('a');
-                a.href = url;
-                a.download = 'selected_images_{index}.txt';
-                document.body.appendChild(a);
-                a.click();
-                URL.revokeObjectURL(url);
-                document.body.removeChild(a);
-            }}
-
-            function loadSelectedTxt() {{
-                const input = document.createElement('input');
-                input.type = 'file';
-                input.accept = '.txt';
-                input.addEventListener('change', (e) => {{
-                    const file = e.target.files[0];
-                    if (file) {{
-                        const reader = new FileReader();
-                        reader.onload = function(event) {{
-                            const lines = event.target.result.split('\\n');
-                            const containers = document.querySelectorAll('.checkbox-container');
-                            containers.forEach(container => {{
-                                const img = container.querySelector('img');
-                                const imgSrc = img.src;
-                                const imgName = imgSrc.substring(imgSrc.lastIndexOf('/') + 1);
-                                
-                                lines.forEach(line => {{
-                                    const lineName = line.substring(line.lastIndexOf('/') + 1);
-                                    if (imgName === lineName) {{
-                                        const checkbox = container.querySelector('input[type="checkbox"]');
-                                        checkbox.checked = true;
-                                        updateCheckboxStyle(checkbox);
-                                    }}
-                                }});
-                            }});
-                        }};
-                        reader.readAsText(file);
-                    }}
-                }});
-                input.click();
-            }}
-        </script>
-    </head>
-    <body>
-        <button id="save-button" class="top-right-button">Save Selected Images</button>
-        <button id="load-button" class="top-left-button">Load Selected Info</button>
-        <table>
-            <tr>
-                <th>Template</th>
-                <th>Images</th>
-                <th>Source Images</th>
-            </tr>
-            {rows}
-        </table>
-    </body>
-    </html>
+        bytes: The embedded JPEG thumbnail, or None if there is none.
     """
+    if exif.startswith(b"Exif\0\0"):
+        exif = exif[6:]
+    endian = {b"II": "<", b"MM": ">"}.get(exif[:2])
+    if endian is None:
+        return None
+    try:
+        ifd0 = struct.unpack_from(endian + "I", exif, 4)[0]
+        entries = struct.unpack_from(endian + "H", exif, ifd0)[0]
+        ifd1 = struct.unpack_from(endian + "I", exif, ifd0 + 2 + 12 * entries)[0]
+        if not ifd1:
+            return None
+        offset = length = None
+        for i in range(struct.unpack_from(endian + "H", exif, ifd1)[0]):
+            position = ifd1 + 2 + 12 * i
+            tag, field_type = struct.unpack_from(endian + "HH", exif, position)
+            # The value of a single SHORT or LONG is stored in the entry itself
+            value = struct.unpack_from(endian + ("H" if field_type == 3 else "I"), exif, position + 8)[0]
+            if tag == 0x0201:  # JPEGInterchangeFormat
+                offset = value
+            elif tag == 0x0202:  # JPEGInterchangeFormatLength
+                length = value
+    except struct.error:
+        return None
+    if not offset or not length or offset + length > len(exif):
+        return None
+    return exif[offset:offset + length]
 
-    rows = ""
-    cur_path = demo_dir_path
-    for template, images in image_groups.items():
-        row = f"<tr><td>{template}</td><td>"
-        for image_path in images:
-            # 存放图片相对于可视化HTML的相对路径
-            rel_path = os.path.relpath(image_path, cur_path)
-            row += f"""
-            <div class="checkbox-container" onclick="toggleCheckbox(this);">
-                <input type="checkbox">
-                <img src="{rel_path}" alt="{template}">
-            </div>
-            """
-        row += "</td><td>"
-        for src_image in src_group.get(template, []):
-            rel_path = os.path.relpath(src_image, cur_path)
-            row += f'<img src="{rel_path}" alt="source_image" class="src-image">'
-        row += "</td></tr>"
-        rows += row
+def _exif_thumbnail(image, size):
+    # The embedded thumbnail of an opened JPEG, if it covers size and has the aspect ratio of the image
+    exif = image.info.get("exif")
+    data = _parse_exif_thumbnail(exif) if exif else None
+    if data is None:
+        return None
+    try:
+        thumb = Image.open(io.BytesIO(data))
+        thumb.load()
+    except (OSError, ValueError):
+        return None
+    if thumb.width < size[0] or thumb.height < size[1]:
+        return None
+    # Some cameras letterbox the thumbnail into a fixed 4:3 or 16:9 frame, those are not usable
+    if abs(thumb.width * image.height - thumb.height * image.width) > 0.01 * image.width * thumb.height:
+        return None
+    return thumb.convert("RGB")
 
-    return html_template.format(index=index, rows=rows)
+# EXIF Orientation tag -> transposition that turns the stored pixels upright, as in `ImageOps.exif_transpose`
+_EXIF_ORIENTATIONS = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
 
+def _exif_orientation(image):
+    # The EXIF Orientation of an opened image, 1 (stored upright) when it has none
+    try:
+        orientation = image.getexif().get(0x0112, 1)
+    except (OSError, ValueError, SyntaxError):
+        return 1
+    return orientation if orientation in _EXIF_ORIENTATIONS else 1
 
+def _upright(image, orientation):
+    # Applies an EXIF orientation to decoded pixels; the EXIF thumbnail is stored like the image, so it needs it too
+    transpose = _EXIF_ORIENTATIONS.get(orientation)
+    return image if transpose is None else image.transpose(transpose)
 
-def visualize_scratch_in_root(leaf_group, src_group, output_dir, demo_lines=25):
-    """
-    Visualizes images in the specified folder by grouping them, generating HTML files, and saving them to the output directory.
-    
-    Parameters:
-        folder_path (str): The path to the folder containing subfolders with images.
-        src_group (dict): A dictionary of source images grouped by their templates.
-        output_dir (str): The directory where the generated HTML files will be saved.
-        demo_lines (int): The number of templates to include per HTML file.
-    """
+def _upright_size(size, orientation):
+    # Orientations 5-8 swap width and height
+    return (size[1], size[0]) if orientation >= 5 else size
 
-    os.makedirs(output_dir, exist_ok=True)
+def _decode_full(image_path, bound):
+    # Full decode, then LANCZOS
+    with Image.open(image_path) as image:
+        image_format = image.format
+        image = _upright(image.convert("RGB"), _exif_orientation(image))
+        return resize_image(image, _fit_size(image.size, bound)), image_format, "full"
 
-    # Custom sorting function, sort by numerical value
-    def sort_key(template):
-        match = re.match(r"(\d+)", template)
-        return int(match.group(1)) if match else float('inf')
-    
-    # Sort templates by numerical value
-    templates = sorted(leaf_group.keys(), key=sort_key)
-    for identifier, img_path_lst in leaf_group.items():
-        leaf_group[identifier] = sorted(img_path_lst)
-    
-    for i in range(0, len(templates), demo_lines):
-        # Generate HTML file name
-        start = i // demo_lines
-        output_file = f'demo_batch_{start + 1}.html'
+def _decode_fast(image_path, bound):
+    # JPEGs use their EXIF thumbnail when it is big enough, else libjpeg's DCT scaling (`Image.draft`) decodes them at
+    # 1/2, 1/4 or 1/8 of their size; LANCZOS only finishes the last step. Other formats are fully decoded.
+    with Image.open(image_path) as image:
+        image_format = image.format
+        orientation = _exif_orientation(image)
+        size = _fit_size(_upright_size(image.size, orientation), bound)
+        stored_size = _upright_size(size, orientation)  # the same size before turning the image upright
+        path = "full"
+        if image_format == "JPEG" and stored_size != image.size:
+            thumb = _exif_thumbnail(image, stored_size)
+            if thumb is not None:
+                return resize_image(_upright(thumb, orientation), size), image_format, "exif"
+            full_size = image.size
+            image.draft("RGB", stored_size)
+            if image.size != full_size:
+                path = "draft"
+        image = _upright(image.convert("RGB"), orientation)
+        return resize_image(image, size), image_format, path
 
-        batch_templates = templates[i:i + demo_lines]
-        batch_image_groups = {tpl: leaf_group[tpl] for tpl in batch_templates}
-        html_content = generate_html_with_templates(batch_image_groups, src_group, "batch_" + str(start+1), output_dir)
-        
-        # Save HTML file
-        with open(os.path.join(output_dir, output_file), 'w') as file:
-            file.write(html_content)
-        
-        print(f"HTML file has been created at {os.path.join(output_dir, output_file)}")
+# Image loading backends: name -> function(image_path, bound) returning (image fitted to bound, format, path taken).
+# Another backend (e.g. pyvips) can be plugged in by adding it here and passing its name as `decoder`.
+# 图片解码后端：可在此加入其它实现，并通过 `decoder` 参数选择。
+IMAGE_DECODERS = {"fast": _decode_fast, "full": _decode_full}
 
-if __name__ == "__main__":
-    # In this case, one image and some similar images can seen as a group. Their filenames can indicate their relationship uniquely.
-    # 本代码解决的是，一张图片与多张图片有对应关系，需要检查并删去多张图片中的不合格图片，常用于手动筛选爬取后的不良图片。 HTML最后会给出你框选的图片路径txt
+def decode_image(image_path, bound, decoder=THUMBNAIL_DECODER):
     """
-    1. Click the frame/button of your targer images, and then click the red button on the top right to [Save Selected Images]/[ctrl + s] to save the selected images' path txt file.
-    You will find a txt file downloaded in your device, which contains the selected images paths.
-    2. Load the selected txt file by clicking the red button on the top left to [Load Selected Info]/[ctrl + d].
-    1. 保存：勾选框，点击图片或者左键框选需要删除的图片，在确认勾选图片正确之后，点击右上角绿色按钮[Save Selected Images]/[ctrl + s],即可保存该demo文件的目标图片路径txt。
-    2. 载入：导入selected_txt，检查选择的图片质量，点击左上角红色按钮[Load Selected Info]/[ctrl + d]
+    Loads an image downscaled to fit in bound, with the selected backend of `IMAGE_DECODERS`.
+
+    Parameters:
+        image_path (str): The path to the image.
+        bound (tuple): The bounding box as a (width, height) tuple; images are never upscaled.
+        decoder (str): "fast" uses the EXIF thumbnail or JPEG draft mode when possible, "full" always decodes fully.
+
+    Returns:
+        tuple: (image, format, path) where image is an RGB PIL image, format the file format (e.g. "JPEG") and
+            path the way it was decoded: "exif", "draft" or "full".
     """
-    # Image selected from source folder
-    # src_folder_path can be none, and source column will be empty in the HTML file
-    src_folder_path = 'data/src'
-    src_group = read_src_img(src_folder_path)
+    return IMAGE_DECODERS[decoder](image_path, bound)
 
-    # Image selected from leaf folder
-    leaf_dir_path = "data/leaf"
-    leaf_group = read_leaf_img(leaf_dir_path)
+def thumbnail_key(image_path, size):
+    """
+    Computes the content-addressed cache key of a thumbnail.
 
-    # Optional: Check the source and leaf image groups
-    with open("json/leaf_group.json", "w") as f:
-        json.dump(leaf_group, f, indent=4)
-    with open("json/src_group.json", "w") as f:
-        json.dump(src_group, f, indent=4)
+    Parameters:
+        image_path (str): The path to the original image.
+        size (tuple): The bounding box of the thumbnail as a (width, height) tuple.
 
-    # Number of groups in one demo file. The number depends on your device and the average number of images per group.
+    Returns:
+        str: A hex digest of the image bytes, the thumbnail size and `THUMBNAIL_VERSION`.
+    """
+    digest = hashlib.sha1(f"v{THUMBNAIL_VERSION}:".encode())
+    with open(image_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    digest.update(f"{size[0]}x{size[1]}".encode())
+    return digest.hexdigest()
+
+def _fit_size(image_size, bound):
+    # Keep the aspect ratio and never upscale small images
+    width, height = image_size
+    scale = min(bound[0] / width, bound[1] / height, 1.0)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def _render_thumbnail(task):
+    """
+    Process pool worker: renders one thumbnail into the cache directory unless it is already cached.
+
+    Parameters:
+        task (tuple): (image_path, size, cache_dir, decoder), decoder is a backend of `IMAGE_DECODERS`.
+
+    Returns:
+        tuple: (image_path, thumbnail_path, decoded), thumbnail_path is None if the image could not be read;
+            decoded is (format, path, seconds) of the decode, or None if the thumbnail was already cached.
+    """
+    image_path, size, cache_dir, decoder = task
+    try:
+        key = thumbnail_key(image_path, size)
+        thumb_path = os.path.join(cache_dir, key[:2], key + ".jpg")
+        if os.path.exists(thumb_path):
+            return image_path, thumb_path, None
+        started = time.perf_counter()
+        thumb, image_format, path = decode_image(image_path, size, decoder)
+        decoded = (image_format, path, time.perf_counter() - started)
+        os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+        # Write to a temporary file first, so a half-written thumbnail is never picked up from the cache
+        tmp_path = f"{thumb_path}.{os.getpid()}.tmp"
+        thumb.save(tmp_path, "JPEG", quality=85)
+        os.replace(tmp_path, thumb_path)
+        return image_path, thumb_path, decoded
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        print(f"Error: Failed to create thumbnail for {image_path}: {e}")
+        return image_path, None, None
+
+def build_thumbnail_cache(leaf_group, src_group, cache_dir=THUMBNAIL_CACHE_DIR,
+                          leaf_size=LEAF_THUMBNAIL_SIZE, src_size=SRC_THUMBNAIL_SIZE, max_workers=None,
+                          manifest=None, decoder=THUMBNAIL_DECODER, prune_manifest=True, probes=None):
+    """
+    Renders downscaled copies of every leaf and source image on a process pool.
+    With a manifest, images whose size and mtime did not change since the last run are neither hashed nor rendered again.
+
+    Parameters:
+        leaf_group (dict): A dictionary of leaf images grouped by their templates.
+        src_group (dict): A dictionary of source images grouped by their templates.
+        cache_dir (str): The content-addressed directory where thumbnails are stored.
+        leaf_size (tuple): The bounding box of leaf thumbnails.
+        src_size (tuple): The bounding box of source thumbnails.
+        max_workers (int): The number of worker processes, defaults to the number of CPUs.
+        manifest (dict): Optional manifest, see `load_manifest`. Its file entries are updated in place.
+        decoder (str): The image loading backend, see `decode_image`. The path every image took is counted per
+            format in `metrics`.
+        prune_manifest (bool): Drop the manifest entries of the images that were not given, False when only
+            some images are passed, see `LiveGallery`.
+        probes (dict): Optional probe results, see `probe_images`. Images flagged as broken are not decoded.
+
+    Returns:
+        dict: A dictionary mapping original image paths to thumbnail paths.
+    """
+    if probes is None:
+        probes = {}
+    tasks = [(path, leaf_size, cache_dir, decoder) for paths in leaf_group.values() for path in paths]
+    tasks += [(path, src_size, cache_dir, decoder) for paths in src_group.values() for path in paths]
+    if not tasks:
+        return {}
+    os.makedirs(cache_dir, exist_ok=True)
+
+    thumbnails = {}
+    files = {}
+    pending = []
+    previous = manifest["files"] if manifest is not None else {}
+    # Thumbnails recorded by an older version were rendered differently, see `THUMBNAIL_VERSION`
+    stale = manifest is not None and manifest.get("thumbnail_version") != THUMBNAIL_VERSION
+    for task in tasks:
+        image_path = task[0]
+        try:
+            stat = os.stat(image_path)
+        except OSError as e:
+            print(f"Error: Failed to create thumbnail for {image_path}: {e}")
+            continue
+        entry = previous.get(image_path, {})
+        if entry.get("size") != stat.st_size or entry.get("mtime") != stat.st_mtime_ns:
+            entry = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+        files[image_path] = entry
+        if image_path in probes and probes[image_path][4] is not None:
+            continue
+        thumb = None if stale else entry.get("thumb")
+        if thumb is not None:
+            thumb_path = os.path.join(cache_dir, thumb[:2], thumb + ".jpg")
+            if os.path.exists(thumb_path):
+                thumbnails[image_path] = thumb_path
+                continue
+        pending.append(task)
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            chunksize = max(1, len(pending) // ((max_workers or os.cpu_count() or 1) * 4))
+            for image_path, thumb_path, decoded in executor.map(_render_thumbnail, pending, chunksize=chunksize):
+                if decoded is not None:
+                    metrics.record_decode(*decoded)
+                if thumb_path is not None:
+                    thumbnails[image_path] = thumb_path
+                    files[image_path]["thumb"] = os.path.splitext(os.path.basename(thumb_path))[0]
+    if manifest is not None and prune_manifest:
+        # Images that no longer exist are dropped from the manifest
+        manifest["files"] = files
+        manifest["thumbnail_version"] = THUMBNAIL_VERSION
+    elif manifest is not None:
+        manifest["files"].update(files)
+    metrics.count("thumbnails_built", len(pending))
+    metrics.count("thumbnails_reused", len(thumbnails) - len(pending))
+    print(f"{len(thumbnails)} thumbnails are ready in {cache_dir}, {len(pending)} of them were (re)built")
+    for image_format, paths in sorted(metrics.decoders.items()):
+        print(f"  {image_format}: " + ", ".join(f"{entry['images']} {path} ({entry['seconds']:.1f}s)"
+                                                for path, entry in sorted(paths.items())))
+    return thumbnails
+
+def _probe_image(image_path):
+    """
+    Thread pool worker: reads the header of one image, and checks that a JPEG, PNG or GIF is not cut short
+    by looking for its end marker in the last PROBE_TAIL_SIZE bytes. No pixel data is decoded.
+    The size is the displayed one, with width and height swapped for EXIF orientations 5-8.
+
+    Returns:
+        tuple: (image_path, (width, height, format, mode, error)), error is None for a sound image.
+    """
+    try:
+        with open(image_path, "rb") as f:
+            with Image.open(f) as image:
+                width, height = _upright_size(image.size, _exif_orientation(image))
+                image_format, mode = image.format, image.mode
+            error = None
+            trailer = _IMAGE_TRAILERS.get(image_format)
+            if trailer is not None:
+                f.seek(0, os.SEEK_END)
+                f.seek(max(0, f.tell() - PROBE_TAIL_SIZE))
+                tail = f.read().rstrip(b"\0")  # some writers pad files with zeros
+                # Cameras and editors may append data after the EOI of a JPEG, so it only has to be near the end
+                if not tail.endswith(trailer) and not (image_format == "JPEG" and trailer in tail):
+                    error = "truncated"
+        return image_path, (width, height, image_format, mode, error)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        return image_path, (0, 0, None, None, str(e) or type(e).__name__)
+
+def probe_images(leaf_group, src_group, max_workers=PROBE_WORKERS, manifest=None):
+    """
+    Reads the size, format and mode of every leaf and source image from its header on a thread pool, and flags
+    truncated or unreadable files. With a manifest, results are cached with the file size and mtime.
+
+    Parameters:
+        leaf_group (dict): A dictionary of leaf images grouped by their templates.
+        src_group (dict): A dictionary of source images grouped by their templates.
+        max_workers (int): The number of I/O threads.
+        manifest (dict): Optional manifest, see `load_manifest`. Its file entries are updated in place.
+
+    Returns:
+        dict: A dictionary mapping image paths to (width, height, format, mode, error) tuples, error is None
+            for a sound image and describes the problem otherwise.
+    """
+    files = manifest["files"] if manifest is not None else {}
+    # Probes recorded by an older version may be wrong, see `PROBE_VERSION`
+    stale = manifest is not None and manifest.get("probe_version") != PROBE_VERSION
+    probes = {}
+    pending = []
+    for group in (leaf_group, src_group):
+        for paths in group.values():
+            for path in paths:
+                try:
+                    stat = os.stat(path)
+                except OSError as e:
+                    probes[path] = (0, 0, None, None, str(e))
+                    continue
+                entry = files.get(path)
+                if entry is None or entry.get("size") != stat.st_size or entry.get("mtime") != stat.st_mtime_ns:
+                    entry = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+                    if manifest is not None:
+                        files[path] = entry
+                cached = None if stale else entry.get("probe")
+                if cached is not None:
+                    probes[path] = tuple(cached)
+                else:
+                    pending.append(path)
+
+    if pending:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for path, probe in executor.map(_probe_image, pending, chunksize=SCAN_CHUNK_SIZE):
+                probes[path] = probe
+                if path in files:
+                    files[path]["probe"] = list(probe)
+    if manifest is not None:
+        manifest["probe_version"] = PROBE_VERSION
+    broken = sum(1 for probe in probes.values() if probe[4] is not None)
+    metrics.count("images_probed", len(pending))
+    metrics.count("images_broken", broken)
+    print(f"{len(probes)} images are probed, {len(pending)} of them were read, {broken} are broken")
+    return probes
+
+def route_broken_images(leaf_group, probes, template=BROKEN_TEMPLATE):
+    """
+    Moves the leaf images flagged by `probe_images` out of their templates into one "broken" group,
+    which sorts after the numbered templates, so they end up together on the last page.
+
+    Parameters:
+        leaf_group (dict): A dictionary of leaf images grouped by their templates.
+        probes (dict): The probe results, see `probe_images`.
+        template (str): The name of the group receiving the broken images.
+
+    Returns:
+        tuple: (leaf_group, broken) where leaf_group is a `GroupStore` (the given one if nothing is broken)
+            and broken the set of broken image paths, to be pre-selected.
+    """
+    broken = {path for paths in leaf_group.values() for path in paths
+              if path in probes and probes[path][4] is not None}
+    if not broken:
+        return leaf_group, broken
+    routed = GroupStore((template if path in broken else name, path)
+                        for name, paths in leaf_group.items() for path in paths)
+    return routed, broken
+
+def _sprite_source(image_path, thumbnails):
+    # The thumbnail is packed when there is one (its name is already a content hash), else the original
+    thumb_path = thumbnails.get(image_path)
+    if thumb_path is not None:
+        return thumb_path, thumb_path
+    stat = os.stat(image_path)
+    return image_path, f"{image_path}:{stat.st_size}:{stat.st_mtime_ns}"
+
+def _render_sprite(task):
+    """
+    Process pool worker: packs the images of one row into a sprite sheet unless it is already cached.
+    Images are placed left to right on shelves at most SPRITE_MAX_WIDTH wide. The cell offsets are saved next to the
+    sheet as JSON after the sheet itself, so an existing offset table always belongs to a complete sheet.
+
+    Parameters:
+        task (tuple): (sprite_path, source_paths, bound, decoder), see `decode_image` for decoder.
+
+    Returns:
+        tuple: (sprite_path, cells) where cells holds one [x, y, width, height] per source image.
+    """
+    sprite_path, sources, bound, decoder = task
+    offsets_path = os.path.splitext(sprite_path)[0] + ".json"
+    if os.path.exists(offsets_path):
+        with open(offsets_path, "r") as f:
+            return sprite_path, json.load(f)["cells"]
+
+    tiles = []
+    for source in sources:
+        try:
+            tiles.append(decode_image(source, bound, decoder)[0])
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            # An unreadable image keeps an empty cell, so it can still be selected
+            print(f"Error: Failed to add {source} to a sprite sheet: {e}")
+            tiles.append(Image.new("RGB", bound, "white"))
+
+    cells = []
+    x = y = shelf_height = width = 0
+    for tile in tiles:
+        if x and x + tile.width > SPRITE_MAX_WIDTH:
+            x, y, shelf_height = 0, y + shelf_height, 0
+        cells.append([x, y, tile.width, tile.height])
+        x += tile.width
+        width = max(width, x)
+        shelf_height = max(shelf_height, tile.height)
+    sheet = Image.new("RGB", (max(width, 1), max(y + shelf_height, 1)), "white")
+    for tile, (x, y, _, _) in zip(tiles, cells):
+        sheet.paste(tile, (x, y))
+
+    os.makedirs(os.path.dirname(sprite_path), exist_ok=True)
+    tmp_path = f"{sprite_path}.{os.getpid()}.tmp"
+    sheet.save(tmp_path, "JPEG", quality=85)
+    os.replace(tmp_path, sprite_path)
+    with open(f"{offsets_path}.{os.getpid()}.tmp", "w") as f:
+        json.dump({"size": list(sheet.size), "cells": cells}, f)
+    os.replace(f"{offsets_path}.{os.getpid()}.tmp", offsets_path)
+    return sprite_path, cells
+
+def build_sprite_sheets(rows, thumbnails=None, cache_dir=SPRITE_CACHE_DIR, bound=LEAF_THUMBNAIL_SIZE, max_workers=None,
+                        decoder=THUMBNAIL_DECODER, probes=None):
+    """
+    Packs the leaf images of every row into one sprite sheet on a process pool, so a row costs one image request
+    and one file open instead of one per image. Rows longer than SPRITE_MAX_CELLS are split over several sheets.
+    Sheets are content-addressed like the thumbnails, so unchanged rows reuse their cached sheet.
+
+    Parameters:
+        rows (iterable): Lists of original leaf image paths, one per template row of the pages.
+        thumbnails (dict): Optional mapping of original image paths to thumbnail paths, packed instead of the originals.
+        cache_dir (str): The content-addressed directory where sprite sheets and their offset tables are stored.
+        bound (tuple): The bounding box of every cell.
+        max_workers (int): The number of worker processes, defaults to the number of CPUs.
+        decoder (str): The image loading backend, see `decode_image`.
+        probes (dict): Optional probe results, see `probe_images`. Images flagged as broken are left out of the
+            sheets and shown on their own.
+
+    Returns:
+        dict: A dictionary mapping original image paths to (sprite_path, x, y, width, height),
+        which can be passed to `write_html_with_templates`.
+    """
+    if thumbnails is None:
+        thumbnails = {}
+    if probes is None:
+        probes = {}
+    tasks = []
+    originals = {}
+    for row in rows:
+        for first in range(0, len(row), SPRITE_MAX_CELLS):
+            images, sources = [], []
+            digest = hashlib.sha1(f"{bound[0]}x{bound[1]}:{SPRITE_MAX_WIDTH}:v{THUMBNAIL_VERSION}".encode())
+            for image_path in row[first:first + SPRITE_MAX_CELLS]:
+                if image_path in probes and probes[image_path][4] is not None:
+                    continue
+                try:
+                    source, key = _sprite_source(image_path, thumbnails)
+                except OSError as e:
+                    print(f"Error: Failed to add {image_path} to a sprite sheet: {e}")
+                    continue
+                images.append(image_path)
+                sources.append(source)
+                digest.update(key.encode() + b"\n")
+            if not images:
+                continue
+            key = digest.hexdigest()
+            sprite_path = os.path.join(cache_dir, key[:2], key + ".jpg")
+            originals[sprite_path] = images
+            tasks.append((sprite_path, sources, bound, decoder))
+
+    sprites = {}
+    if not tasks:
+        return sprites
+    os.makedirs(cache_dir, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        chunksize = max(1, len(tasks) // ((max_workers or os.cpu_count() or 1) * 4))
+        for sprite_path, cells in executor.map(_render_sprite, tasks, chunksize=chunksize):
+            for image_path, cell in zip(originals[sprite_path], cells):
+                sprites[image_path] = (sprite_path, *cell)
+    metrics.count("sprite_sheets", len(tasks))
+    print(f"{len(tasks)} sprite sheets are ready in {cache_dir} for {len(sprites)} images")
+    return sprites
+
+# CSS and JavaScript shared by every batch page. They are written once into the output directory by
+# `write_gallery_assets`, so browsers cache them across pages and each page only carries its data.
+# 所有批次页面共用的 CSS 和 JavaScript，只在输出目录中写一次，浏览器可在页面间缓存。
+GALLERY_CSS = """\
+table {
+    width: 100%;
+    border-collapse: collapse;
+    font-size: 14px;
+}
+th, td {
+    border: 1px solid black;
+    padding: 7px;
+    text-align: center;
+}
+img {
+    max-width: 200px;
+    max-height: 200px;
+    margin: 5px;
+    cursor: pointer;
+}
+.checkbox-container {
+    display: inline-block;
+    align-items: center;
+    cursor: pointer;
+    position: relative;
+    border: 2px solid transparent; /* 默认边框透明 */
+}
+.checkbox-container input {
+    margin-right: 5px;
+    pointer-events: none; /* clicks go to the container */
+}
+.checkbox-container input:checked + img {
+    /* An outline does not take space, so checking an image never moves the containers after it (see rectIndex) */
+    outline: 2px solid red; /* 选中时边框为红色 */
+    outline-offset: -2px;
+}
+.sprite {
+    display: inline-block;
+    margin: 5px;
+    cursor: pointer;
+    vertical-align: bottom;
+    background-repeat: no-repeat;
+}
+.selection-box {
+    border: 1px dashed #000;
+    position: absolute;
+    z-index: 1000;
+    background: rgba(0, 0, 0, 0.1);
+}
+.top-right-button {
+    position: fixed;
+    top: 10px;
+    right: 10px;
+    padding: 10px 20px;
+    background-color: #4CAF50;
+    color: white;
+    border: none;
+    cursor: pointer;
+    font-size: 16px;
+}
+.top-left-button {
+    position: fixed;
+    top: 10px;
+    left: 10px;
+    padding: 10px 20px;
+    background-color: red;
+    color: white;
+    border: none;
+    cursor: pointer;
+    font-size: 16px;
+}
+.reload-notice {
+    position: fixed;
+    top: 10px;
+    left: 50%;
+    transform: translateX(-50%);
+    padding: 10px 20px;
+    background-color: #FF9800;
+    color: white;
+    border: none;
+    cursor: pointer;
+    font-size: 16px;
+    z-index: 1001;
+}
+.src-image {
+    width: 800px;
+    height: 800px;
+    margin: 5px;
+    cursor: pointer;
+}
+.highlight {
+    border: 2px solid red; /* 高亮时边框为红色 */
+}
+.checkbox-container.preview {
+    outline: 2px dashed #2196F3; /* 框选预览 */
+}
+.load-progress {
+    position: fixed;
+    top: 60px;
+    left: 10px;
+    padding: 5px 10px;
+    background-color: rgba(0, 0, 0, 0.7);
+    color: white;
+    font-size: 14px;
+    z-index: 1001;
+}
+
+/* Virtualized gallery, see VIRTUAL_GALLERY_JS */
+.virtual-header {
+    display: flex;
+    margin-top: 50px;
+    border: 1px solid black;
+    font-size: 14px;
+    font-weight: bold;
+}
+.virtual-header div {
+    padding: 7px;
+    text-align: center;
+}
+#gallery {
+    position: relative;
+    width: 100%;
+}
+.virtual-row {
+    position: absolute;
+    left: 0;
+    right: 0;
+    border-bottom: 1px solid black;
+    box-sizing: border-box;
+}
+.virtual-label {
+    position: absolute;
+    top: 0;
+    bottom: 0;
+    left: 0;
+    width: 100px;
+    display: flex;
+    align-items: center;
+    justify-content: center;
+    border-right: 1px solid black;
+    font-size: 14px;
+}
+.virtual-sources {
+    position: absolute;
+    top: 0;
+    bottom: 0;
+    right: 0;
+    width: 420px;
+    border-left: 1px solid black;
+    text-align: center;
+}
+.virtual-sources img {
+    width: 400px;
+    height: 400px;
+    object-fit: contain;
+}
+.virtual-line {
+    position: absolute;
+    display: flex;
+}
+.virtual-line .checkbox-container {
+    display: flex;
+    align-items: center;
+    justify-content: center;
+    width: 210px;
+    height: 210px;
+    margin: 0 2px 4px 0;
+    box-sizing: border-box;
+}
+.virtual-line .checkbox-container input {
+    position: absolute;
+    top: 2px;
+    left: 2px;
+    margin: 0;
+}
+.virtual-line .checkbox-container.checked {
+    border: 2px solid red;
+}
+"""
+
+GALLERY_JS = """\
+let isSelecting = false;
+let startX, startY;
+let selectionBox;
+let previewFrame = null;
+let previewed = new Set();
+
+// Spatial index of the container rectangles for rubber-band selection: page coordinates bucketed
+// into a grid of INDEX_CELL px, so a selection only tests the containers in the cells it overlaps.
+// Page coordinates do not change on scroll; the index is dropped whenever the layout may have changed
+// (window resize, images loading and resizing the table), and rebuilt with one batch of layout reads on the next drag.
+const INDEX_CELL = 256;
+let rectIndex = null;
+
+function invalidateRectIndex() {
+    rectIndex = null;
+}
+
+function buildRectIndex() {
+    rectIndex = new Map();
+    const scrollX = window.scrollX;
+    const scrollY = window.scrollY;
+    document.querySelectorAll('.checkbox-container').forEach(container => {
+        const r = container.getBoundingClientRect();
+        const entry = {
+            left: r.left + scrollX,
+            top: r.top + scrollY,
+            right: r.right + scrollX,
+            bottom: r.bottom + scrollY,
+            container: container,
+        };
+        for (let cx = Math.floor(entry.left / INDEX_CELL); cx <= Math.floor(entry.right / INDEX_CELL); cx++) {
+            for (let cy = Math.floor(entry.top / INDEX_CELL); cy <= Math.floor(entry.bottom / INDEX_CELL); cy++) {
+                const key = cx + ',' + cy;
+                const bucket = rectIndex.get(key);
+                if (bucket) {
+                    bucket.push(entry);
+                } else {
+                    rectIndex.set(key, [entry]);
+                }
+            }
+        }
+    });
+}
+
+function queryRectIndex(left, top, right, bottom) {
+    // Containers overlapping the rectangle, in page coordinates
+    const result = new Set();
+    for (let cx = Math.floor(left / INDEX_CELL); cx <= Math.floor(right / INDEX_CELL); cx++) {
+        for (let cy = Math.floor(top / INDEX_CELL); cy <= Math.floor(bottom / INDEX_CELL); cy++) {
+            const bucket = rectIndex.get(cx + ',' + cy);
+            if (!bucket) {
+                continue;
+            }
+            bucket.forEach(entry => {
+                if (
+                    entry.left < right &&
+                    entry.right > left &&
+                    entry.top < bottom &&
+                    entry.bottom > top
+                ) {
+                    result.add(entry.container);
+                }
+            });
+        }
+    }
+    return result;
+}
+
+function selectionRect(currentX, currentY) {
+    return [Math.min(startX, currentX), Math.min(startY, currentY), Math.max(startX, currentX), Math.max(startY, currentY)];
+}
+
+function previewSelection(currentX, currentY) {
+    // Only class writes here, no layout reads
+    const hits = queryRectIndex(...selectionRect(currentX, currentY));
+    previewed.forEach(container => {
+        if (!hits.has(container)) {
+            container.classList.remove('preview');
+        }
+    });
+    hits.forEach(container => container.classList.add('preview'));
+    previewed = hits;
+}
+
+function clearPreview() {
+    previewed.forEach(container => container.classList.remove('preview'));
+    previewed = new Set();
+}
+
+document.addEventListener('DOMContentLoaded', (event) => {
+    window.addEventListener('resize', invalidateRectIndex);
+    if (window.ResizeObserver) {
+        new ResizeObserver(invalidateRectIndex).observe(document.body);
+    }
+    document.querySelectorAll('.checkbox-container img').forEach(img => img.addEventListener('load', invalidateRectIndex));
+
+    document.addEventListener('mousedown', (e) => {
+        if (e.button === 0 && e.target.closest('.checkbox-container')) {
+            e.preventDefault();
+            if (rectIndex === null) {
+                buildRectIndex();
+            }
+            isSelecting = true;
+            startX = e.pageX;
+            startY = e.pageY;
+            selectionBox = document.createElement('div');
+            selectionBox.className = 'selection-box';
+            selectionBox.style.left = startX + 'px';
+            selectionBox.style.top = startY + 'px';
+            document.body.appendChild(selectionBox);
+        }
+    });
+
+    document.addEventListener('mousemove', (e) => {
+        if (isSelecting) {
+            const currentX = e.pageX;
+            const currentY = e.pageY;
+            const width = Math.abs(currentX - startX);
+            const height = Math.abs(currentY - startY);
+            selectionBox.style.width = width + 'px';
+            selectionBox.style.height = height + 'px';
+            selectionBox.style.left = Math.min(startX, currentX) + 'px';
+            selectionBox.style.top = Math.min(startY, currentY) + 'px';
+            if (previewFrame === null) {
+                previewFrame = requestAnimationFrame(() => {
+                    previewFrame = null;
+                    if (isSelecting) {
+                        previewSelection(currentX, currentY);
+                    }
+                });
+            }
+        }
+    });
+
+    document.addEventListener('mouseup', (e) => {
+        if (isSelecting) {
+            isSelecting = false;
+            clearPreview();
+            // A click is a selection of zero size and toggles the container under the pointer
+            queryRectIndex(...selectionRect(e.pageX, e.pageY)).forEach(toggleCheckbox);
+            selectionBox.parentNode.removeChild(selectionBox);
+        }
+    });
+
+    fetchServerSelection((paths, deselected) => {
+        applyDeselectedPaths(deselected);
+        applySelectedLines(paths, true);
+    });
+    subscribeGalleryEvents(appendImages, paths => applySelectedLines(paths, true));
+
+    document.getElementById('save-button').addEventListener('click', saveSelectedImages);
+    document.getElementById('load-button').addEventListener('click', loadSelectedTxt);
+
+    document.addEventListener('keydown', (e) => {
+        if (e.ctrlKey && e.key === 's') {
+            e.preventDefault();
+            saveSelectedImages();
+        }
+        if (e.ctrlKey && e.key === 'l') {
+            e.preventDefault();
+            loadSelectedTxt();
+        }
+    });
+});
+
+function appendImages(template, images) {
+    // Images added to a template row of this page by `watch` mode, see `subscribeGalleryEvents`
+    const row = Array.from(document.querySelectorAll('tr')).find(tr => tr.cells[0].textContent === template);
+    if (!row) {
+        showReloadNotice();
+        return;
+    }
+    images.forEach(image => {
+        const container = document.createElement('div');
+        container.className = 'checkbox-container';
+        const checkbox = document.createElement('input');
+        checkbox.type = 'checkbox';
+        checkbox.checked = image.checked;
+        if (image.checked) {
+            container.style.border = '2px solid red';
+        }
+        const img = document.createElement('img');
+        img.src = image.thumb;
+        img.dataset.original = image.original;
+        img.alt = template;
+        if (image.width && image.height) {
+            img.width = image.width;
+            img.height = image.height;
+        }
+        img.addEventListener('load', invalidateRectIndex);
+        container.appendChild(checkbox);
+        container.appendChild(img);
+        row.cells[1].appendChild(container);
+    });
+    invalidateRectIndex();
+}
+
+function toggleCheckbox(container) {
+    const checkbox = container.querySelector('input[type="checkbox"]');
+    checkbox.checked = !checkbox.checked;
+    updateCheckboxStyle(checkbox);
+}
+
+function updateCheckboxStyle(checkbox) {
+    const container = checkbox.closest('.checkbox-container');
+    if (checkbox.checked) {
+        container.style.border = '2px solid red';
+    } else {
+        container.style.border = '2px solid transparent';
+    }
+    if (!applyingServerSelection) {
+        queueSelectionChange(container.querySelector('[data-original]').dataset.original, checkbox.checked);
+    }
+}
+
+
+function saveSelectedImages() {
+    const selectedImages = [];
+    const checkboxes = document.querySelectorAll('.checkbox-container input[type="checkbox"]:checked');
+    checkboxes.forEach(checkbox => {
+        const img = checkbox.nextElementSibling;
+
+        // 保存原图相对于HTML的路径，而不是缩略图或拼图路径
+        // Save the original image path relative to the HTML file, not the thumbnail or sprite sheet path
+        selectedImages.push(img.dataset.original);
+    });
+
+
+    const blob = new Blob([selectedImages.join('\\n')], { type: 'text/plain' });
+    const url = URL.createObjectURL(blob);
+    const a = document.createElement('a');
+    a.href = url;
+    a.download = 'selected_images_' + document.body.dataset.batch + '.txt';
+    document.body.appendChild(a);
+    a.click();
+    URL.revokeObjectURL(url);
+    document.body.removeChild(a);
+}
+
+function loadSelectedTxt() {
+    const input = document.createElement('input');
+    input.type = 'file';
+    input.accept = '.txt';
+    input.addEventListener('change', (e) => {
+        const file = e.target.files[0];
+        if (file) {
+            const reader = new FileReader();
+            reader.onload = function(event) {
+                applySelectedLines(event.target.result.split('\\n'));
+            };
+            reader.readAsText(file);
+        }
+    });
+    input.click();
+}
+
+// True while selections received from the review server are applied, so they are not sent back
+let applyingServerSelection = false;
+
+function applyDeselectedPaths(paths) {
+    // Unchecks the images deselected on the review server, e.g. pre-selected near-duplicates a reviewer kept
+    if (paths.length === 0) {
+        return;
+    }
+    const deselected = new Set(paths);
+    applyingServerSelection = true;
+    document.querySelectorAll('.checkbox-container input[type="checkbox"]:checked').forEach(checkbox => {
+        const original = checkbox.closest('.checkbox-container').querySelector('[data-original]').dataset.original;
+        if (deselected.has(original)) {
+            checkbox.checked = false;
+            updateCheckboxStyle(checkbox);
+        }
+    });
+    applyingServerSelection = false;
+}
+
+function applySelectedLines(lines, fromServer = false) {
+    // One pass over the containers builds a map keyed on the full relative path (and its resolved URL),
+    // then one pass over the lines looks each of them up: O(images + lines), and same-named files
+    // in different folders no longer collide.
+    const containers = new Map();
+    document.querySelectorAll('.checkbox-container').forEach(container => {
+        const original = container.querySelector('[data-original]').dataset.original;
+        containers.set(original, container);
+        containers.set(resolveUrl(original), container);
+    });
+
+    // Large files are applied in chunks, one per frame, so the progress indicator can repaint
+    const progress = document.createElement('div');
+    progress.className = 'load-progress';
+    document.body.appendChild(progress);
+    const chunkSize = 5000;
+    let position = 0;
+    let matched = 0;
+
+    function applyChunk() {
+        const end = Math.min(lines.length, position + chunkSize);
+        applyingServerSelection = fromServer;
+        for (; position < end; position++) {
+            const line = lines[position].trim();
+            if (!line) {
+                continue;
+            }
+            const container = containers.get(line) || containers.get(resolveUrl(line));
+            if (container) {
+                const checkbox = container.querySelector('input[type="checkbox"]');
+                if (!checkbox.checked) {
+                    checkbox.checked = true;
+                    updateCheckboxStyle(checkbox);
+                }
+                matched++;
+            }
+        }
+        applyingServerSelection = false;
+        progress.textContent = `Loading selection: ${position} / ${lines.length} lines, ${matched} images selected`;
+        if (position < lines.length) {
+            requestAnimationFrame(applyChunk);
+        } else {
+            setTimeout(() => progress.remove(), 2000);
+        }
+    }
+    applyChunk();
+}
+"""
+
+# Script of the virtualized page mode (render_mode="virtual"), for templates with thousands of images.
+# 虚拟化页面模式的脚本，只渲染视口内的图片行，适用于每组有成千上万张图片的情况。
+VIRTUAL_GALLERY_JS = """\
+// Virtualized gallery: the page only carries the group/image list as JSON, and only the image
+// lines inside the viewport (plus some overscan) are in the DOM at any time.
+// Selection state lives in `selected`, keyed on the original image path relative to the page.
+const CELL_WIDTH = 212;      // leaf cell (210px) + its 2px right margin, see .virtual-line .checkbox-container
+const CELL_HEIGHT = 214;     // leaf cell (210px) + its 4px bottom margin
+const LABEL_WIDTH = 100;
+const SOURCE_WIDTH = 420;    // source thumbnails are shown at 400px in this mode
+const SOURCE_CELL = 410;
+const OVERSCAN = 800;        // px rendered above and below the viewport
+
+let groups = [];             // [{template, images: [{original, thumb}], sources: [thumb], top, lines, height}]
+let perLine = 1;
+let galleryTop = 0;
+let galleryLeft = 0;
+let gallery;
+let renderQueued = false;
+const selected = new Set();
+const rendered = new Map();  // 'g<group>' or '<group>:<line>' -> element currently in the DOM
+
+let isSelecting = false;
+let startX, startY;
+let selectionBox;
+
+document.addEventListener('DOMContentLoaded', (event) => {
+    gallery = document.getElementById('gallery');
+    loadGalleryData();
+    layout();
+
+    window.addEventListener('scroll', scheduleRender, { passive: true });
+    window.addEventListener('resize', layout);
+    fetchServerSelection((paths, deselected) => {
+        // Pre-selected images the reviewers unchecked stay unchecked
+        deselected.forEach(path => selected.delete(path));
+        paths.forEach(path => selected.add(path));
+        refreshSelection();
+    });
+    subscribeGalleryEvents(appendImages, paths => {
+        paths.forEach(path => selected.add(path));
+        refreshSelection();
+    });
+
+    gallery.addEventListener('mousedown', (e) => {
+        if (e.button !== 0 || !e.target.closest('.checkbox-container')) {
+            return;
+        }
+        e.preventDefault();
+        isSelecting = true;
+        startX = e.pageX;
+        startY = e.pageY;
+        selectionBox = document.createElement('div');
+        selectionBox.className = 'selection-box';
+        selectionBox.style.left = startX + 'px';
+        selectionBox.style.top = startY + 'px';
+        document.body.appendChild(selectionBox);
+    });
+
+    document.addEventListener('mousemove', (e) => {
+        if (isSelecting) {
+            selectionBox.style.width = Math.abs(e.pageX - startX) + 'px';
+            selectionBox.style.height = Math.abs(e.pageY - startY) + 'px';
+            selectionBox.style.left = Math.min(startX, e.pageX) + 'px';
+            selectionBox.style.top = Math.min(startY, e.pageY) + 'px';
+        }
+    });
+
+    document.addEventListener('mouseup', (e) => {
+        if (isSelecting) {
+            isSelecting = false;
+            selectionBox.parentNode.removeChild(selectionBox);
+            // Cells are laid out on a fixed grid, so hits are computed arithmetically without reading the DOM
+            toggleRect(Math.min(startX, e.pageX), Math.min(startY, e.pageY),
+                       Math.max(startX, e.pageX), Math.max(startY, e.pageY));
+        }
+    });
+
+    document.getElementById('save-button').addEventListener('click', saveSelectedImages);
+    document.getElementById('load-button').addEventListener('click', loadSelectedTxt);
+
+    document.addEventListener('keydown', (e) => {
+        if (e.ctrlKey && e.key === 's') {
+            e.preventDefault();
+            saveSelectedImages();
+        }
+        if (e.ctrlKey && e.key === 'l') {
+            e.preventDefault();
+            loadSelectedTxt();
+        }
+    });
+});
+
+function loadGalleryData() {
+    // Paths are stored as [dir index, file name] pairs against a table of directories
+    const data = JSON.parse(document.getElementById('gallery-data').textContent);
+    const dirs = data.dirs;
+    const path = (entry, offset) => dirs[entry[offset]] + entry[offset + 1];
+    groups = data.groups.map(group => ({
+        template: group.t,
+        images: group.i.map(entry => ({
+            original: path(entry, 0),
+            thumb: entry.length > 2 ? path(entry, 2) : path(entry, 0),
+        })),
+        sources: group.s.map(entry => path(entry, 0)),
+    }));
+    // Images pre-selected by the generator, e.g. near-duplicates
+    data.groups.forEach((group, g) => (group.p || []).forEach(i => selected.add(groups[g].images[i].original)));
+}
+
+function appendImages(template, images) {
+    // Images added to a group of this page by `watch` mode, see `subscribeGalleryEvents`
+    const group = groups.find(group => group.template === template);
+    if (!group) {
+        showReloadNotice();
+        return;
+    }
+    images.forEach(image => {
+        group.images.push({ original: image.original, thumb: image.thumb });
+        if (image.checked) {
+            selected.add(image.original);
+        }
+    });
+    layout();
+}
+
+function layout() {
+    const rect = gallery.getBoundingClientRect();
+    galleryTop = rect.top + window.scrollY;
+    galleryLeft = rect.left + window.scrollX;
+    perLine = Math.max(1, Math.floor((rect.width - LABEL_WIDTH - SOURCE_WIDTH) / CELL_WIDTH));
+    let top = 0;
+    groups.forEach(group => {
+        group.top = top;
+        group.lines = Math.max(1, Math.ceil(group.images.length / perLine));
+        group.height = Math.max(group.lines * CELL_HEIGHT, group.sources.length * SOURCE_CELL);
+        top += group.height;
+    });
+    gallery.style.height = top + 'px';
+    rendered.forEach(element => element.remove());
+    rendered.clear();
+    scheduleRender();
+}
+
+function scheduleRender() {
+    if (!renderQueued) {
+        renderQueued = true;
+        requestAnimationFrame(render);
+    }
+}
+
+function groupAt(y) {
+    // Index of the first group whose bottom is below y
+    let low = 0, high = groups.length;
+    while (low < high) {
+        const mid = (low + high) >> 1;
+        if (groups[mid].top + groups[mid].height <= y) {
+            low = mid + 1;
+        } else {
+            high = mid;
+        }
+    }
+    return low;
+}
+
+function render() {
+    renderQueued = false;
+    const viewTop = window.scrollY - galleryTop - OVERSCAN;
+    const viewBottom = window.scrollY - galleryTop + window.innerHeight + OVERSCAN;
+    const wanted = new Set();
+    for (let g = groupAt(viewTop); g < groups.length && groups[g].top < viewBottom; g++) {
+        const group = groups[g];
+        const key = 'g' + g;
+        wanted.add(key);
+        if (!rendered.has(key)) {
+            addElement(key, renderGroup(group));
+        }
+        const firstLine = Math.max(0, Math.floor((viewTop - group.top) / CELL_HEIGHT));
+        const lastLine = Math.min(group.lines - 1, Math.floor((viewBottom - group.top) / CELL_HEIGHT));
+        for (let line = firstLine; line <= lastLine; line++) {
+            const lineKey = g + ':' + line;
+            wanted.add(lineKey);
+            if (!rendered.has(lineKey)) {
+                addElement(lineKey, renderLine(group, g, line));
+            }
+        }
+    }
+    rendered.forEach((element, key) => {
+        if (!wanted.has(key)) {
+            element.remove();
+            rendered.delete(key);
+        }
+    });
+}
+
+function addElement(key, element) {
+    rendered.set(key, element);
+    gallery.appendChild(element);
+}
+
+function renderGroup(group) {
+    const row = document.createElement('div');
+    row.className = 'virtual-row';
+    row.style.top = group.top + 'px';
+    row.style.height = group.height + 'px';
+    const label = document.createElement('div');
+    label.className = 'virtual-label';
+    label.textContent = group.template;
+    row.appendChild(label);
+    const sources = document.createElement('div');
+    sources.className = 'virtual-sources';
+    group.sources.forEach(source => {
+        const img = document.createElement('img');
+        img.loading = 'lazy';
+        img.decoding = 'async';
+        img.src = source;
+        img.alt = 'source_image';
+        sources.appendChild(img);
+    });
+    row.appendChild(sources);
+    return row;
+}
+
+function renderLine(group, g, line) {
+    const element = document.createElement('div');
+    element.className = 'virtual-line';
+    element.style.top = (group.top + line * CELL_HEIGHT) + 'px';
+    element.style.left = LABEL_WIDTH + 'px';
+    const end = Math.min(group.images.length, (line + 1) * perLine);
+    for (let i = line * perLine; i < end; i++) {
+        const image = group.images[i];
+        const container = document.createElement('div');
+        container.className = 'checkbox-container';
+        container.dataset.original = image.original;
+        const checkbox = document.createElement('input');
+        checkbox.type = 'checkbox';
+        checkbox.tabIndex = -1;
+        const img = document.createElement('img');
+        img.loading = 'lazy';
+        img.decoding = 'async';
+        img.src = image.thumb;
+        img.alt = group.template;
+        container.appendChild(checkbox);
+        container.appendChild(img);
+        updateContainerStyle(container);
+        element.appendChild(container);
+    }
+    return element;
+}
+
+function updateContainerStyle(container) {
+    const checked = selected.has(container.dataset.original);
+    container.classList.toggle('checked', checked);
+    container.firstChild.checked = checked;
+}
+
+function refreshSelection() {
+    gallery.querySelectorAll('.virtual-line .checkbox-container').forEach(updateContainerStyle);
+}
+
+function toggleImage(original) {
+    if (selected.has(original)) {
+        selected.delete(original);
+    } else {
+        selected.add(original);
+    }
+    queueSelectionChange(original, selected.has(original));
+}
+
+function toggleRect(left, top, right, bottom) {
+    // Convert page coordinates to gallery coordinates and toggle every cell the rectangle overlaps
+    left -= galleryLeft + LABEL_WIDTH;
+    right -= galleryLeft + LABEL_WIDTH;
+    top -= galleryTop;
+    bottom -= galleryTop;
+    const firstCol = Math.max(0, Math.floor(left / CELL_WIDTH));
+    const lastCol = Math.min(perLine - 1, Math.floor(right / CELL_WIDTH));
+    for (let g = groupAt(top); g < groups.length && groups[g].top <= bottom; g++) {
+        const group = groups[g];
+        const firstLine = Math.max(0, Math.floor((top - group.top) / CELL_HEIGHT));
+        const lastLine = Math.min(group.lines - 1, Math.floor((bottom - group.top) / CELL_HEIGHT));
+        for (let line = firstLine; line <= lastLine; line++) {
+            for (let col = firstCol; col <= lastCol; col++) {
+                const i = line * perLine + col;
+                if (i < group.images.length) {
+                    toggleImage(group.images[i].original);
+                }
+            }
+        }
+    }
+    refreshSelection();
+}
+
+function selectedInPageOrder() {
+    const result = [];
+    groups.forEach(group => group.images.forEach(image => {
+        if (selected.has(image.original)) {
+            result.push(image.original);
+        }
+    }));
+    return result;
+}
+
+function saveSelectedImages() {
+    const blob = new Blob([selectedInPageOrder().join('\\n')], { type: 'text/plain' });
+    const url = URL.createObjectURL(blob);
+    const a = document.createElement('a');
+    a.href = url;
+    a.download = 'selected_images_' + document.body.dataset.batch + '.txt';
+    document.body.appendChild(a);
+    a.click();
+    URL.revokeObjectURL(url);
+    document.body.removeChild(a);
+}
+
+function loadSelectedTxt() {
+    const input = document.createElement('input');
+    input.type = 'file';
+    input.accept = '.txt';
+    input.addEventListener('change', (e) => {
+        const file = e.target.files[0];
+        if (file) {
+            const reader = new FileReader();
+            reader.onload = function(event) {
+                applySelectedLines(event.target.result.split('\\n'));
+            };
+            reader.readAsText(file);
+        }
+    });
+    input.click();
+}
+
+function applySelectedLines(lines) {
+    // Lines are matched like in the table mode, on the relative path or its resolved URL, and only the images
+    // of this page are selected, so the selections of other pages are not recorded as changes of this one
+    const originals = new Map();
+    groups.forEach(group => group.images.forEach(image => {
+        originals.set(image.original, image.original);
+        originals.set(resolveUrl(image.original), image.original);
+    }));
+
+    // Large files are applied in chunks, one per frame, so the progress indicator can repaint
+    const progress = document.createElement('div');
+    progress.className = 'load-progress';
+    document.body.appendChild(progress);
+    const chunkSize = 5000;
+    let position = 0;
+    let matched = 0;
+
+    function applyChunk() {
+        const end = Math.min(lines.length, position + chunkSize);
+        for (; position < end; position++) {
+            const line = lines[position].trim();
+            if (!line) {
+                continue;
+            }
+            const original = originals.get(line) || originals.get(resolveUrl(line));
+            if (original) {
+                if (!selected.has(original)) {
+                    selected.add(original);
+                    queueSelectionChange(original, true);
+                }
+                matched++;
+            }
+        }
+        refreshSelection();
+        progress.textContent = `Loading selection: ${position} / ${lines.length} lines, ${matched} images selected`;
+        if (position < lines.length) {
+            requestAnimationFrame(applyChunk);
+        } else {
+            setTimeout(() => progress.remove(), 2000);
+        }
+    }
+    applyChunk();
+}
+"""
+
+RENDER_MODES = ("table", "virtual", "sprite")
+
+# Loaded by both page modes before their own script, see `serve`
+SELECTION_SYNC_JS = """\
+// Selection sync with the local review server (`serve` command). Only active when the page is served
+// over HTTP; pages opened from file:// keep working with txt downloads only.
+// Changes are debounced and posted in batches; the server appends them to one shared selection store.
+const SYNC_ENABLED = location.protocol === 'http:' || location.protocol === 'https:';
+const SYNC_DELAY = 500;
+const SYNC_RETRY_DELAY = 5000;
+let pendingChanges = new Map();  // path -> selected, a later change of a path replaces the earlier one
+let syncTimer = null;
+
+function resolveUrl(path) {
+    // Loaded selection txt files may hold absolute URLs instead of paths relative to the page, both page modes
+    // match them against the resolved URLs of their images
+    try {
+        return new URL(path, document.baseURI).href;
+    } catch (e) {
+        return path;
+    }
+}
+
+function queueSelectionChange(path, selected) {
+    if (!SYNC_ENABLED) {
+        return;
+    }
+    pendingChanges.set(path, selected);
+    if (syncTimer === null) {
+        syncTimer = setTimeout(flushSelectionChanges, SYNC_DELAY);
+    }
+}
+
+function takeSelectionChanges() {
+    const changes = Array.from(pendingChanges, ([path, selected]) => ({ path: path, selected: selected }));
+    pendingChanges = new Map();
+    return JSON.stringify({ page: document.body.dataset.batch, changes: changes });
+}
+
+function flushSelectionChanges() {
+    syncTimer = null;
+    if (pendingChanges.size === 0) {
+        return;
+    }
+    const failed = new Map(pendingChanges);
+    fetch('/api/selection', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: takeSelectionChanges(),
+    }).then(response => {
+        if (!response.ok) {
+            throw new Error('HTTP ' + response.status);
+        }
+    }).catch(() => {
+        // Keep the changes that were not superseded meanwhile and retry later
+        failed.forEach((selected, path) => {
+            if (!pendingChanges.has(path)) {
+                pendingChanges.set(path, selected);
+            }
+        });
+        if (syncTimer === null) {
+            syncTimer = setTimeout(flushSelectionChanges, SYNC_RETRY_DELAY);
+        }
+    });
+}
+
+function fetchServerSelection(callback) {
+    // Calls callback with the selected and the deselected paths stored on the server
+    if (!SYNC_ENABLED) {
+        return;
+    }
+    fetch('/api/selection', { cache: 'no-store' })
+        .then(response => response.json())
+        .then(data => callback(data.selected, data.deselected || []))
+        .catch(() => {});
+}
+
+window.addEventListener('pagehide', () => {
+    if (SYNC_ENABLED && pendingChanges.size > 0) {
+        navigator.sendBeacon('/api/selection', new Blob([takeSelectionChanges()], { type: 'application/json' }));
+    }
+});
+
+// Live updates of `watch` mode: images appended to this page are added in place with appendImages(template, images),
+// images of the page that became pre-selected are checked with selectImages(paths), any other change of this page
+// shows a notice to reload it.
+function subscribeGalleryEvents(appendImages, selectImages) {
+    if (!SYNC_ENABLED || !window.EventSource) {
+        return;
+    }
+    const page = decodeURIComponent(location.pathname.split('/').pop());
+    const events = new EventSource('/api/events');
+    events.addEventListener('images', (e) => {
+        const data = JSON.parse(e.data);
+        if (data.page === page) {
+            data.groups.forEach(group => appendImages(group.template, group.images));
+            if (data.selected.length > 0) {
+                selectImages(data.selected);
+            }
+        }
+    });
+    events.addEventListener('changed', (e) => {
+        if (JSON.parse(e.data).pages.includes(page)) {
+            showReloadNotice();
+        }
+    });
+}
+
+function showReloadNotice() {
+    if (document.querySelector('.reload-notice')) {
+        return;
+    }
+    const notice = document.createElement('button');
+    notice.className = 'reload-notice';
+    notice.textContent = 'This page changed, click to reload';
+    notice.addEventListener('click', () => location.reload());
+    document.body.appendChild(notice);
+}
+"""
+
+# Pages reference the assets with this version, so a changed asset is never served from a stale browser cache
+GALLERY_ASSET_VERSION = hashlib.sha1(
+    (GALLERY_CSS + GALLERY_JS + VIRTUAL_GALLERY_JS + SELECTION_SYNC_JS).encode()).hexdigest()[:12]
+
+def write_gallery_assets(output_dir):
+    """
+    Writes the shared `gallery.css`, `gallery.js`, `gallery-virtual.js` and `gallery-sync.js` into the output directory,
+    unless they are already up to date.
+
+    Parameters:
+        output_dir (str): The directory where the HTML files are saved.
+
+    Returns:
+        str: The asset version referenced by the pages.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    for name, content in (("gallery.css", GALLERY_CSS), ("gallery.js", GALLERY_JS),
+                          ("gallery-virtual.js", VIRTUAL_GALLERY_JS), ("gallery-sync.js", SELECTION_SYNC_JS)):
+        path = os.path.join(output_dir, name)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                if f.read() == content:
+                    continue
+        with open(f"{path}.{os.getpid()}.tmp", "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(f"{path}.{os.getpid()}.tmp", path)
+        print(f"Gallery asset has been created at {path}")
+    return GALLERY_ASSET_VERSION
+
+def _dct_matrix(n):
+    # Orthonormal DCT-II matrix, the 2D DCT of a block X is C @ X @ C.T
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.sqrt(2.0 / n) * np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+_DCT_MATRIX = _dct_matrix(PHASH_SIZE)
+
+def _perceptual_hash(image_path):
+    """
+    Process pool worker: computes the 64-bit perceptual hash (pHash) of one image.
+    The image is reduced to 32x32 grayscale; each bit tells whether one of the 8x8 lowest DCT frequencies
+    is above their median.
+
+    Returns:
+        tuple: (image_path, hash as int), hash is None if the image could not be read.
+    """
+    try:
+        with Image.open(image_path) as image:
+            gray = image.convert("L").resize((PHASH_SIZE, PHASH_SIZE), Image.Resampling.LANCZOS)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        print(f"Error: Failed to hash {image_path}: {e}")
+        return image_path, None
+    pixels = np.asarray(gray, dtype=np.float64)
+    low = (_DCT_MATRIX @ pixels @ _DCT_MATRIX.T)[:8, :8].ravel()
+    bits = low > np.median(low[1:])  # the DC term is left out of the median
+    return image_path, int(np.packbits(bits).view(">u8")[0])
+
+def compute_perceptual_hashes(leaf_group, src_group, max_workers=None, manifest=None, probes=None):
+    """
+    Computes the perceptual hashes of every leaf and source image on a process pool.
+
+    Parameters:
+        leaf_group (dict): A dictionary of leaf images grouped by their templates.
+        src_group (dict): A dictionary of source images grouped by their templates.
+        max_workers (int): The number of worker processes, defaults to the number of CPUs.
+        manifest (dict): Optional manifest, see `load_manifest`. Hashes of unchanged images are reused from it;
+            pass it after `build_thumbnail_cache`, which keeps its file entries up to date.
+        probes (dict): Optional probe results, see `probe_images`. Images flagged as broken are not hashed.
+
+    Returns:
+        tuple: (leaf_hashes, src_hashes), each a dictionary {template: (paths, hashes)} where hashes is a
+            packed uint64 NumPy array aligned with paths. Images that could not be read are left out.
+    """
+    files = manifest["files"] if manifest is not None else {}
+    if probes is None:
+        probes = {}
+    hashes = {}
+    pending = []
+    for group in (leaf_group, src_group):
+        for paths in group.values():
+            for path in paths:
+                if path in probes and probes[path][4] is not None:
+                    continue
+                cached = files.get(path, {}).get("phash")
+                if cached is not None:
+                    hashes[path] = cached
+                else:
+                    pending.append(path)
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            chunksize = max(1, len(pending) // ((max_workers or os.cpu_count() or 1) * 4))
+            for path, value in executor.map(_perceptual_hash, pending, chunksize=chunksize):
+                if value is not None:
+                    hashes[path] = value
+                    if path in files:
+                        files[path]["phash"] = value
+    print(f"{len(hashes)} perceptual hashes are ready, {len(pending)} of them were computed")
+    metrics.count("phash_computed", len(pending))
+
+    def pack(group):
+        packed = {}
+        for template, paths in group.items():
+            kept = [path for path in paths if path in hashes]
+            packed[template] = (kept, np.array([hashes[path] for path in kept], dtype=np.uint64))
+        return packed
+    return pack(leaf_group), pack(src_group)
+
+def hamming_distances(a, b):
+    """
+    Computes the pairwise Hamming distances between two arrays of packed 64-bit hashes.
+
+    Parameters:
+        a (numpy.ndarray): A uint64 array of length n.
+        b (numpy.ndarray): A uint64 array of length m.
+
+    Returns:
+        numpy.ndarray: A (n, m) uint8 array of distances.
+    """
+    xor = a[:, None] ^ b[None, :]
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(xor)
+    # Population count through a byte lookup table on NumPy < 2.0
+    return _POPCOUNT_TABLE[xor.view(np.uint8)].reshape(xor.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def find_near_duplicates(leaf_hashes, src_hashes, threshold=PHASH_THRESHOLD, block_size=PHASH_BLOCK_SIZE):
+    """
+    Finds near-duplicate leaf images within every template and against the template's source images.
+    Within a template the first image (in path order) of a run of near-duplicates is kept and the later ones are reported;
+    leaf images close to a source image are always reported.
+
+    Parameters:
+        leaf_hashes (dict): Leaf hashes as returned by `compute_perceptual_hashes`.
+        src_hashes (dict): Source hashes as returned by `compute_perceptual_hashes`.
+        threshold (int): The maximum Hamming distance between two hashes of near-duplicates.
+        block_size (int): The side of the tiles of the distance matrix computed at once, which bounds its memory
+            to block_size x block_size whatever the group size.
+
+    Returns:
+        dict: A dictionary mapping every near-duplicate leaf image path to the path it duplicates.
+    """
+    duplicates = {}
+    for template, (paths, hashes) in leaf_hashes.items():
+        if len(paths) == 0:
+            continue
+        order = np.argsort(np.array(paths, dtype=object))
+        paths = [paths[i] for i in order]
+        hashes = hashes[order]
+
+        src_paths, src_values = src_hashes.get(template, ([], np.empty(0, dtype=np.uint64)))
+        if len(src_paths):
+            for start in range(0, len(paths), block_size):
+                distances = hamming_distances(hashes[start:start + block_size], src_values)
+                close = distances <= threshold
+                for i in np.flatnonzero(close.any(axis=1)):
+                    duplicates[paths[start + i]] = src_paths[int(np.argmin(distances[i]))]
+
+        # Only an earlier image can make a later one a duplicate, so only the tiles on and above the diagonal are
+        # compared. Row tiles go in path order, so the first hit of a column is the earliest image it duplicates.
+        for row_start in range(0, len(paths), block_size):
+            rows = np.arange(row_start, min(row_start + block_size, len(paths)))
+            for column_start in range(row_start, len(paths), block_size):
+                columns = np.arange(column_start, min(column_start + block_size, len(paths)))
+                close = hamming_distances(hashes[rows], hashes[columns]) <= threshold
+                if column_start == row_start:
+                    close &= rows[:, None] < columns[None, :]
+                hit_rows = np.argmax(close, axis=0)
+                for j in np.flatnonzero(close.any(axis=0)):
+                    duplicates.setdefault(paths[columns[j]], paths[rows[hit_rows[j]]])
+    return duplicates
+
+def export_selection_txt(paths, txt_path, demo_dir_path):
+    """
+    Writes image paths in the txt format produced by "Save Selected Images", so it can be loaded into the pages.
+
+    Parameters:
+        paths (iterable): The image paths to write.
+        txt_path (str): The path to the txt file.
+        demo_dir_path (str): The directory of the HTML files; paths are written relative to it, like the pages do.
+    """
+    relpath = _relpath_resolver(demo_dir_path)
+    os.makedirs(os.path.dirname(txt_path) or ".", exist_ok=True)
+    with open(txt_path, "w", encoding="utf-8") as f:
+        f.write("\n".join("".join(relpath(path)) for path in paths))
+
+def _relpath_resolver(start):
+    """
+    Returns a function splitting paths into (folder relative to `start`, file name).
+    Images share a few folders, so `os.path.relpath` is computed once per folder instead of once per image.
+    The folder is "" or ends with a separator, so the relative path is simply folder + name.
+    """
+    rel_dirs = {}
+
+    def resolve(path):
+        dir_path, name = os.path.split(path)
+        rel_dir = rel_dirs.get(dir_path)
+        if rel_dir is None:
+            metrics.count("relpath_computed")
+            rel_dir = os.path.relpath(dir_path or os.curdir, start)
+            rel_dir = rel_dirs[dir_path] = "" if rel_dir == os.curdir else rel_dir + os.sep
+        return rel_dir, name
+    return resolve
+
+def _html_relpath_resolver(start):
+    # HTML-escaped paths relative to `start`, see `_relpath_resolver`
+    resolve = _relpath_resolver(start)
+
+    def relpath(path):
+        rel_dir, name = resolve(path)
+        return html.escape(rel_dir + name)
+    return relpath
+
+def iter_html_with_templates(image_groups, src_group, index, demo_dir_path, thumbnails=None, preselected=None,
+                             sprites=None, probes=None):
+    """
+    Renders the HTML page for displaying images and their templates piece by piece.
+    Pieces are small (one image at most), so a page of any size can be written with bounded memory.
+    
+    Parameters:
+        image_groups (dict): A dictionary of grouped images by their templates.
+        src_group (dict): A dictionary of source images grouped by their templates.
+        index (int): The index of the current batch of images.
+        demo_dir_path (str): The directory path where the HTML file will be saved.
+        thumbnails (dict): Optional mapping of original image paths to thumbnail paths.
+            Pages display the thumbnails, while the original paths are still the values that get selected and saved.
+        preselected (set): Optional image paths that are checked when the page opens, e.g. near-duplicates.
+        sprites (dict): Optional mapping of original image paths to sprite sheet cells, see `build_sprite_sheets`.
+            Those images are drawn as a cell of their row's sheet instead of an <img> of their own.
+        probes (dict): Optional image sizes, see `probe_images`. Leaf images get the width and height they are
+            displayed at, so the page does not reflow while they load.
+        Pages load `gallery.css`/`gallery.js` from demo_dir_path, see `write_gallery_assets`.
+        
+    Yields:
+        str: Consecutive pieces of the HTML content.
+    """
+    html_template = """
+    <!DOCTYPE html>
+    <html lang="en">
+    <head>
+        <meta charset="UTF-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1.0">
+        <title>Image Gallery</title>
+        <link rel="stylesheet" href="gallery.css?v={version}">
+        <script src="gallery-sync.js?v={version}"></script>
+        <script src="gallery.js?v={version}"></script>
+    </head>
+    <body data-batch="{index}">
+        <button id="save-button" class="top-right-button">Save Selected Images</button>
+        <button id="load-button" class="top-left-button">Load Selected Info</button>
+        <table>
+            <tr>
+                <th>Template</th>
+                <th>Images</th>
+                <th>Source Images</th>
+            </tr>
+            {rows}
+        </table>
+    </body>
+    </html>
+    """
+
+    if thumbnails is None:
+        thumbnails = {}
+    if preselected is None:
+        preselected = set()
+    if sprites is None:
+        sprites = {}
+    if probes is None:
+        probes = {}
+    # Only the small head is formatted, the rows are streamed in between head and tail
+    head, tail = html_template.split("{rows}")
+    yield head.format(index=html.escape(str(index)), version=GALLERY_ASSET_VERSION)
+
+    # 存放图片相对于可视化HTML的相对路径
+    relpath = _html_relpath_resolver(demo_dir_path)
+    for template, images in image_groups.items():
+        yield f"<tr><td>{template}</td><td>"
+        for image_path in images:
+            checked = image_path in preselected
+            cell = sprites.get(image_path)
+            if cell is None:
+                image = f'<img src="{relpath(thumbnails.get(image_path, image_path))}" data-original="{relpath(image_path)}" alt="{template}"'
+                probe = probes.get(image_path)
+                if probe is not None and probe[0] and probe[1]:
+                    image += ' width="%d" height="%d"' % _fit_size(probe[:2], LEAF_THUMBNAIL_SIZE)
+                image += '>'
+            else:
+                sprite_path, x, y, width, height = cell
+                image = (f'<span class="sprite" data-original="{relpath(image_path)}" title="{template}" '
+                         f'style="background-image: url(\'{relpath(sprite_path)}\'); background-position: -{x}px -{y}px; '
+                         f'width: {width}px; height: {height}px;"></span>')
+            yield f"""
+            <div class="checkbox-container"{' style="border: 2px solid red;"' if checked else ''}>
+                <input type="checkbox"{' checked' if checked else ''}>
+                {image}
+            </div>
+            """
+        yield "</td><td>"
+        for src_image in src_group.get(template, []):
+            yield f'<img src="{relpath(thumbnails.get(src_image, src_image))}" alt="source_image" class="src-image">'
+        yield "</td></tr>"
+
+    yield tail.format()
+
+def _script_json(value):
+    # Compact JSON that is safe inside a <script> element
+    return json.dumps(value, separators=(",", ":")).replace("</", "<\\/")
+
+def iter_virtual_html_with_templates(image_groups, src_group, index, demo_dir_path, thumbnails=None, preselected=None):
+    """
+    Renders a virtualized HTML page for displaying images and their templates piece by piece.
+    The page only carries the group/image list as compact JSON; `gallery-virtual.js` draws the rows
+    inside the viewport and keeps the selection in a JavaScript Set, so groups with thousands of images stay responsive.
+    
+    Parameters:
+        image_groups, src_group, index, demo_dir_path, thumbnails, preselected: See `iter_html_with_templates`.
+        
+    Yields:
+        str: Consecutive pieces of the HTML content.
+    """
+    if thumbnails is None:
+        thumbnails = {}
+    if preselected is None:
+        preselected = set()
+    yield f"""
+    <!DOCTYPE html>
+    <html lang="en">
+    <head>
+        <meta charset="UTF-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1.0">
+        <title>Image Gallery</title>
+        <link rel="stylesheet" href="gallery.css?v={GALLERY_ASSET_VERSION}">
+        <script src="gallery-sync.js?v={GALLERY_ASSET_VERSION}"></script>
+        <script src="gallery-virtual.js?v={GALLERY_ASSET_VERSION}"></script>
+    </head>
+    <body data-batch="{html.escape(str(index))}">
+        <button id="save-button" class="top-right-button">Save Selected Images</button>
+        <button id="load-button" class="top-left-button">Load Selected Info</button>
+        <div class="virtual-header">
+            <div style="width: 100px;">Template</div>
+            <div style="flex: 1;">Images</div>
+            <div style="width: 420px;">Source Images</div>
+        </div>
+        <div id="gallery"></div>
+        <script type="application/json" id="gallery-data">"""
+
+    # Paths are written as [folder index, file name] against a table of folders relative to the page,
+    # leaf images as [original folder, original name, thumbnail folder, thumbnail name] when a thumbnail exists
+    resolve = _relpath_resolver(demo_dir_path)
+    dir_ids = {}
+
+    def entry(path):
+        rel_dir, name = resolve(path)
+        dir_id = dir_ids.get(rel_dir)
+        if dir_id is None:
+            dir_id = dir_ids[rel_dir] = len(dir_ids)
+        return [dir_id, name]
+
+    yield '{"groups":['
+    for n, (template, images) in enumerate(image_groups.items()):
+        leaf_entries = []
+        for image_path in images:
+            thumb_path = thumbnails.get(image_path)
+            leaf_entries.append(entry(image_path) + (entry(thumb_path) if thumb_path else []))
+        src_entries = [entry(thumbnails.get(src_image, src_image)) for src_image in src_group.get(template, [])]
+        group = {"t": template, "i": leaf_entries, "s": src_entries}
+        checked = [i for i, image_path in enumerate(images) if image_path in preselected]
+        if checked:
+            group["p"] = checked
+        yield ("," if n else "") + _script_json(group)
+    yield '],"dirs":' + _script_json(list(dir_ids)) + "}"
+    yield """</script>
+    </body>
+    </html>
+    """
+
+def write_html_with_templates(file, image_groups, src_group, index, demo_dir_path, thumbnails=None,
+                              render_mode="table", preselected=None, sprites=None, probes=None):
+    """
+    Writes the HTML page for displaying images and their templates straight to an open file.
+    
+    Parameters:
+        file (file object): The text file the page is written to.
+        image_groups, src_group, index, demo_dir_path, thumbnails, preselected: See `iter_html_with_templates`.
+        render_mode (str): "table" renders every image up front, "virtual" only draws the rows in the viewport,
+            see `iter_virtual_html_with_templates`, and "sprite" renders the table with one sprite sheet per row.
+        sprites (dict): The sprite sheet cells used by the "sprite" mode, see `build_sprite_sheets`.
+        probes (dict): Optional image sizes written into the table markup, see `probe_images`.
+    """
+    if render_mode not in RENDER_MODES:
+        raise ValueError(f"Unknown render mode {render_mode}, expected one of {RENDER_MODES}")
+    if render_mode == "virtual":
+        file.writelines(iter_virtual_html_with_templates(image_groups, src_group, index, demo_dir_path, thumbnails,
+                                                         preselected))
+    else:
+        file.writelines(iter_html_with_templates(image_groups, src_group, index, demo_dir_path, thumbnails, preselected,
+                                                 sprites if render_mode == "sprite" else None, probes))
+
+def generate_html_with_templates(image_groups, src_group, index, demo_dir_path, thumbnails=None, preselected=None,
+                                 sprites=None, probes=None):
+    """
+    Generates HTML content for displaying images and their templates.
+    Prefer `write_html_with_templates` for large pages, it does not hold the whole page in memory.
+    
+    Parameters:
+        image_groups (dict): A dictionary of grouped images by their templates.
+        src_group (dict): A dictionary of source images grouped by their templates.
+        index (int): The index of the current batch of images.
+        demo_dir_path (str): The directory path where the HTML file will be saved.
+        thumbnails (dict): Optional mapping of original image paths to thumbnail paths.
+            Pages display the thumbnails, while the original paths are still the values that get selected and saved.
+        preselected (set): Optional image paths that are checked when the page opens, e.g. near-duplicates.
+        sprites (dict): Optional sprite sheet cells drawing each row from one image, see `build_sprite_sheets`.
+        probes (dict): Optional image sizes written into the markup, see `probe_images`.
+        
+    Returns:
+        str: The generated HTML content.
+    """
+    return "".join(iter_html_with_templates(image_groups, src_group, index, demo_dir_path, thumbnails, preselected,
+                                            sprites, probes))
+
+
+
+def _image_bytes(path, thumbnails):
+    # What the browser downloads for an image: its thumbnail if there is one, otherwise the original
+    try:
+        return os.path.getsize(thumbnails.get(path, path))
+    except OSError:
+        return 0
+
+def partition_batches(leaf_group, templates, src_group=None, demo_lines=25, max_images=None, max_bytes=None,
+                      thumbnails=None):
+    """
+    Splits sorted templates into batch pages of balanced cost instead of a fixed number of templates.
+    A page is closed before it would exceed `demo_lines` templates, `max_images` leaf images or `max_bytes`
+    of thumbnail bytes; a template that does not fit on one page is split across consecutive pages.
+    
+    Parameters:
+        leaf_group (dict): A dictionary of leaf images grouped by their templates.
+        templates (list): The templates in page order.
+        src_group (dict): Optional dictionary of source images, counted in the bytes of every page showing them.
+        demo_lines (int): The maximum number of templates per page.
+        max_images (int): Optional maximum number of leaf images per page.
+        max_bytes (int): Optional maximum number of thumbnail bytes per page.
+        thumbnails (dict): Optional mapping of original image paths to thumbnail paths, see `build_thumbnail_cache`.
+        
+    Returns:
+        tuple: (pages, stats). pages is a list of pages, each a list of (template, start, end) slices of leaf_group[template];
+            stats is a list of per-page {"groups", "images", "bytes", "first", "last"} dictionaries.
+    """
+    if src_group is None:
+        src_group = {}
+    if thumbnails is None:
+        thumbnails = {}
+    image_limit = max_images if max_images else float('inf')
+    byte_limit = max_bytes if max_bytes else float('inf')
+
+    pages, stats = [], []
+    page, page_images, page_bytes = [], 0, 0
+
+    def close_page():
+        nonlocal page, page_images, page_bytes
+        if page:
+            pages.append(page)
+            stats.append({"groups": len(page), "images": page_images, "bytes": page_bytes,
+                          "first": page[0][0], "last": page[-1][0]})
+        page, page_images, page_bytes = [], 0, 0
+
+    for template in templates:
+        images = leaf_group[template]
+        costs = [_image_bytes(path, thumbnails) for path in images]
+        src_bytes = sum(_image_bytes(path, thumbnails) for path in src_group.get(template, []))
+        position = 0
+        while True:
+            if len(page) >= demo_lines:
+                close_page()
+            # A template that fits on a page of its own is never split: start a new page for it instead
+            rest_images, rest_bytes = len(images) - position, src_bytes + sum(costs[position:])
+            fits_alone = rest_images <= image_limit and rest_bytes <= byte_limit
+            if page and fits_alone and (page_images + rest_images > image_limit or page_bytes + rest_bytes > byte_limit):
+                close_page()
+            # Take as many images as fit on the current page, at least one on an empty page
+            end, slice_bytes = position, src_bytes
+            while end < len(images) and page_images + (end - position) < image_limit:
+                if page_bytes + slice_bytes + costs[end] > byte_limit and (page or end > position):
+                    break
+                slice_bytes += costs[end]
+                end += 1
+            if end == position and images and page:
+                close_page()
+                continue
+            page.append((template, position, end))
+            page_images += end - position
+            page_bytes += slice_bytes
+            position = end
+            if position >= len(images):
+                break
+            close_page()
+    close_page()
+    return pages, stats
+
+def _render_page(task):
+    """
+    Process pool worker: writes one batch page to a temporary file next to it and renames it into place,
+    so the review server and browsers never see a half-written page.
+
+    Parameters:
+        task (tuple): (output_path, *arguments of `write_html_with_templates` after the file).
+
+    Returns:
+        tuple: (output_path, bytes written, counters), counters are what the page added to `metrics.counters`, which
+            only the parent process saves.
+    """
+    output_path, args = task[0], task[1:]
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    counters = dict(metrics.counters)
+    try:
+        with open(tmp_path, "w") as file:
+            write_html_with_templates(file, *args)
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    counters = {name: n - counters.get(name, 0) for name, n in metrics.counters.items() if n != counters.get(name, 0)}
+    return output_path, os.path.getsize(output_path), counters
+
+def _render_pages(tasks, max_workers=PAGE_WORKERS):
+    # Yields (output_path, size) as pages are written. Tasks are consumed lazily and at most two per worker are in flight,
+    # so only a few pages' data is copied out of the groups at a time; a single page is rendered in this process
+    tasks = iter(tasks)
+    first = next(tasks, None)
+    second = next(tasks, None)
+    if second is None:
+        if first is not None:
+            yield _render_page(first)[:2]
+        return
+
+    def collect(future):
+        # The counters of a worker process are added to this process's metrics
+        output_path, size, counters = future.result()
+        for name, n in counters.items():
+            metrics.count(name, n)
+        return output_path, size
+
+    workers = max_workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = {executor.submit(_render_page, first), executor.submit(_render_page, second)}
+        for task in tasks:
+            if len(in_flight) >= workers * 2:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield collect(future)
+            in_flight.add(executor.submit(_render_page, task))
+        for future in in_flight:
+            yield collect(future)
+
+def write_batch_index(stats, output_dir, leaf_group=None, index_page=BATCH_INDEX_PAGE):
+    """
+    Writes the summary page linking every batch page with its template range, group count, image count and
+    thumbnail bytes. The review server redirects "/" to it.
+
+    Parameters:
+        stats (list): The per-page stats returned by `visualize_scratch_in_root`.
+        output_dir (str): The directory where the HTML files are saved.
+        leaf_group (dict): Optional leaf groups, a template split across pages is then shown with its image range.
+        index_page (str): The file name of the summary page.
+
+    Returns:
+        str: The path of the summary page.
+    """
+    def label(template, start, end):
+        if leaf_group is None or (start == 0 and end == len(leaf_group[template])):
+            return html.escape(str(template))
+        return f"{html.escape(str(template))} [{start + 1}-{end}]"
+
+    rows = []
+    for page in stats:
+        first, last = page["slices"][0], page["slices"][-1]
+        templates = label(*first) if len(page["slices"]) == 1 else f"{label(*first)} &ndash; {label(*last)}"
+        rows.append(f'<tr><td><a href="{html.escape(page["page"])}">{html.escape(page["page"])}</a></td>'
+                    f'<td>{templates}</td><td>{page["groups"]}</td><td>{page["images"]}</td>'
+                    f'<td>{page["bytes"] / 1e6:.1f}</td></tr>')
+    total_images = sum(page["images"] for page in stats)
+    total_bytes = sum(page["bytes"] for page in stats)
+    content = f"""<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <title>Image Gallery Batches</title>
+    <link rel="stylesheet" href="gallery.css?v={GALLERY_ASSET_VERSION}">
+</head>
+<body>
+    <table>
+        <tr><th>Page</th><th>Templates</th><th>Groups</th><th>Images</th><th>Thumbnails (MB)</th></tr>
+        {"".join(rows)}
+        <tr><th>{len(stats)} pages</th><th></th><th></th><th>{total_images}</th><th>{total_bytes / 1e6:.1f}</th></tr>
+    </table>
+</body>
+</html>
+"""
+    index_path = os.path.join(output_dir, index_page)
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp_path, index_path)
+    return index_path
+
+def _page_signature(index, batch_image_groups, src_group, thumbnails, render_mode, preselected, sprites=None,
+                    probes=None):
+    # Everything a batch page is rendered from, plus the generator itself, so a page is
+    # only rewritten when its contents or this script changed
+    digest = hashlib.sha1((_GENERATOR_VERSION + render_mode).encode())
+    for template, images in batch_image_groups.items():
+        images, sources = list(images), list(src_group.get(template, []))
+        digest.update(json.dumps([index, template, images, sources,
+                                  [thumbnails.get(path) for path in images + sources],
+                                  [path in preselected for path in images]]).encode())
+        if sprites:
+            digest.update(json.dumps([sprites.get(path) for path in images]).encode())
+        if probes:
+            digest.update(json.dumps([probes.get(path) for path in images]).encode())
+    return digest.hexdigest()
+
+def visualize_scratch_in_root(leaf_group, src_group, output_dir, demo_lines=25, thumbnails=None, manifest=None,
+                              render_mode="table", max_images=None, max_bytes=None, stats_path=None, preselected=None,
+                              probes=None, max_workers=PAGE_WORKERS):
+    """
+    Visualizes images in the specified folder by grouping them, generating HTML files, and saving them to the output directory.
+    
+    Parameters:
+        folder_path (str): The path to the folder containing subfolders with images.
+        src_group (dict): A dictionary of source images grouped by their templates.
+        output_dir (str): The directory where the generated HTML files will be saved.
+        demo_lines (int): The number of templates to include per HTML file.
+        thumbnails (dict): Optional mapping of original image paths to thumbnail paths, see `build_thumbnail_cache`.
+        manifest (dict): Optional manifest, see `load_manifest`. Only the batch pages whose contents changed are rewritten.
+        render_mode (str): "table", "virtual" or "sprite", see `write_html_with_templates`.
+        max_images (int): Optional maximum number of leaf images per HTML file, see `partition_batches`.
+        max_bytes (int): Optional maximum number of thumbnail bytes per HTML file, see `partition_batches`.
+        stats_path (str): Optional path of a JSON file receiving the per-page cost stats.
+        preselected (set): Optional image paths that are checked when the pages open, see `find_near_duplicates`.
+        probes (dict): Optional image sizes written into the markup, see `probe_images`.
+        max_workers (int): The number of processes rendering the pages that changed, defaults to the number of CPUs.
+            Page numbers only depend on the partition, and every page is written to a temporary file first.
+            The summary page `write_batch_index` is rewritten on every run.
+
+    Returns:
+        list: Per-page cost stats, see `partition_batches`, with the "page" file name and its (template, start, end)
+            "slices".
+    """
+
+    os.makedirs(output_dir, exist_ok=True)
+    write_gallery_assets(output_dir)
+    if thumbnails is None:
+        thumbnails = {}
+    if preselected is None:
+        preselected = set()
+    previous_pages = manifest["pages"] if manifest is not None else {}
+    pages = {}
+    pending = []
+
+    # Custom sorting function, sort by numerical value
+    def sort_key(template):
+        match = re.match(r"(\d+)", template)
+        return int(match.group(1)) if match else float('inf')
+    
+    # Sort templates by numerical value
+    templates = sorted(leaf_group.keys(), key=sort_key)
+    if isinstance(leaf_group, GroupStore):
+        # Sorted once, in place; the batches below are views into the store
+        leaf_group.sort()
+    else:
+        for identifier, img_path_lst in leaf_group.items():
+            leaf_group[identifier] = sorted(img_path_lst)
+    
+    with metrics.stage("partition"):
+        batches, stats = partition_batches(leaf_group, templates, src_group, demo_lines, max_images, max_bytes, thumbnails)
+    sprites = None
+    if render_mode == "sprite":
+        with metrics.stage("sprites"):
+            sprites = build_sprite_sheets((leaf_group[tpl][first:last] for batch in batches for tpl, first, last in batch),
+                                          thumbnails, probes=probes)
+    for start, batch in enumerate(batches):
+        # Generate HTML file name
+        output_file = f'demo_batch_{start + 1}.html'
+        stats[start]["page"] = output_file
+        stats[start]["slices"] = batch
+
+        batch_image_groups = {tpl: leaf_group[tpl][first:last] for tpl, first, last in batch}
+        output_path = os.path.join(output_dir, output_file)
+        signature = _page_signature("batch_" + str(start+1), batch_image_groups, src_group, thumbnails, render_mode,
+                                    preselected, sprites, probes)
+        pages[output_path] = signature
+        if manifest is not None:
+            for images in batch_image_groups.values():
+                for image_path in images:
+                    if image_path in manifest["files"]:
+                        manifest["files"][image_path]["batch"] = output_file
+        if previous_pages.get(output_path) == signature and os.path.exists(output_path):
+            metrics.count("pages_unchanged")
+            print(f"HTML file is unchanged at {output_path}")
+            continue
+        pending.append(start)
+
+    def page_tasks():
+        # Only what one page is rendered from is copied and sent to the worker
+        for start in pending:
+            images = {tpl: list(leaf_group[tpl][first:last]) for tpl, first, last in batches[start]}
+            sources = {tpl: list(src_group.get(tpl, [])) for tpl in images}
+            paths = [path for group in (images, sources) for paths in group.values() for path in paths]
+            yield (os.path.join(output_dir, stats[start]["page"]), images, sources, "batch_" + str(start + 1),
+                   output_dir, {path: thumbnails[path] for path in paths if path in thumbnails}, render_mode,
+                   {path for path in paths if path in preselected},
+                   {path: sprites[path] for path in paths if path in sprites} if sprites else None,
+                   {path: probes[path] for path in paths if path in probes} if probes else None)
+
+    # Save HTML files on a process pool, rows are written as they are rendered
+    with metrics.stage("render_pages"):
+        for output_path, size in _render_pages(page_tasks(), max_workers):
+            metrics.count("pages_written")
+            metrics.record_batch(os.path.basename(output_path), size)
+            print(f"HTML file has been created at {output_path}")
+    print(f"Summary page has been written at {write_batch_index(stats, output_dir, leaf_group)}")
+
+    if manifest is not None:
+        # Remove batch pages written by a previous run that no longer have any templates
+        for output_path in previous_pages:
+            if output_path not in pages and os.path.exists(output_path):
+                os.remove(output_path)
+                print(f"HTML file has been removed at {output_path}")
+        manifest["pages"] = pages
+
+    if stats:
+        images = [page["images"] for page in stats]
+        sizes = [page["bytes"] for page in stats]
+        print(f"{len(stats)} pages: {min(images)}-{max(images)} images (mean {sum(images) / len(images):.0f}), "
+              f"{min(sizes) / 1e6:.1f}-{max(sizes) / 1e6:.1f} MB of thumbnails per page")
+    if stats_path is not None:
+        os.makedirs(os.path.dirname(stats_path) or ".", exist_ok=True)
+        with open(stats_path, "w") as f:
+            json.dump(stats, f, indent=4)
+    return stats
+
+class SelectionStore:
+    """
+    Append-only store of selection changes, shared by every page and reviewer of a review server.
+    Each line of the file is one JSON change {"time", "page", "path", "selected"}, where path is the original image path
+    relative to the HTML directory, as saved by the pages. The current selection is the last change of every path;
+    deselections are kept too, so images the pages pre-select (near-duplicates, broken files) stay unchecked on reload.
+    """
+
+    def __init__(self, store_path=SELECTION_STORE_PATH):
+        self.store_path = store_path
+        self.selected = {}  # path -> page of the last change, in selection order
+        self.deselected = set()
+        if os.path.exists(store_path):
+            with open(store_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self._apply(json.loads(line))
+                    except (ValueError, KeyError, TypeError):
+                        # A torn last line after a crash is skipped
+                        continue
+        os.makedirs(os.path.dirname(store_path) or ".", exist_ok=True)
+        self._file = open(store_path, "a", encoding="utf-8")
+        if self._file.tell() > 0:
+            with open(store_path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self._file.write("\n")
+
+    def _apply(self, change):
+        if change["selected"]:
+            self.selected[change["path"]] = change.get("page")
+            self.deselected.discard(change["path"])
+        else:
+            self.selected.pop(change["path"], None)
+            self.deselected.add(change["path"])
+
+    def append(self, page, changes):
+        """
+        Appends a batch of changes with a single write.
+
+        Parameters:
+            page (str): The batch page the changes come from.
+            changes (list): A list of {"path": str, "selected": bool} dictionaries.
+
+        Returns:
+            int: The number of changes stored.
+        """
+        now = time.time()
+        lines = []
+        for change in changes:
+            path = change.get("path") if isinstance(change, dict) else None
+            if not isinstance(path, str) or not path:
+                continue
+            record = {"time": now, "page": page, "path": path, "selected": bool(change.get("selected"))}
+            self._apply(record)
+            lines.append(json.dumps(record, ensure_ascii=False) + "\n")
+        if lines:
+            self._file.write("".join(lines))
+            self._file.flush()
+        return len(lines)
+
+    def close(self):
+        self._file.close()
+
+class ReviewServer:
+    """
+    Minimal asyncio HTTP/1.1 server for reviewing batch pages on localhost.
+    Static files of the pages, image and cache directories under root_dir are served with ETag/Last-Modified
+    validation and single byte-range support; /api/selection reads (GET) and updates (POST) the shared
+    `SelectionStore`, and /api/events streams the updates of `watch` mode to the open pages as server-sent events.
+    Updates are only accepted as JSON from the server's own origin, so other web pages cannot write to the store.
+    """
+
+    def __init__(self, root_dir=".", pages_dir="html", store=None, thumbnail_dir=THUMBNAIL_CACHE_DIR,
+                 sprite_dir=SPRITE_CACHE_DIR, image_dirs=SERVER_IMAGE_DIRS):
+        self.root_dir = os.path.abspath(root_dir)
+        self.pages_dir = pages_dir
+        self.store = store if store is not None else SelectionStore()
+        self.thumbnail_dir = os.path.join(self.root_dir, thumbnail_dir)
+        self.sprite_dir = os.path.join(self.root_dir, sprite_dir)
+        # Nothing else under root_dir is served, such as .git or the json directory
+        self.served_dirs = [os.path.normpath(os.path.join(self.root_dir, directory))
+                            for directory in (pages_dir, self.thumbnail_dir, self.sprite_dir, *image_dirs) if directory]
+        self.subscribers = set()  # one event queue per open /api/events stream
+        self.routes = {
+            ("GET", "/api/selection"): self.get_selection,
+            ("POST", "/api/selection"): self.post_selection,
+            ("GET", "/api/events"): self.get_events,
+        }
+
+    async def handle(self, reader, writer):
+        # One connection, possibly several requests when the browser keeps it alive
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self.send(writer, 400, body=b"Bad Request")
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length") or 0)
+                if length > SERVER_MAX_BODY:
+                    await self.send(writer, 413, body=b"Payload Too Large")
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                url = urllib.parse.urlsplit(target)
+                path = urllib.parse.unquote(url.path)
+                handler = self.routes.get((method, path))
+                if handler is not None and method == "POST" and not self.same_origin(writer, headers):
+                    await self.send(writer, 403, body=b"Forbidden")
+                elif handler is not None:
+                    await handler(writer, headers, body)
+                elif method in ("GET", "HEAD"):
+                    await self.send_static(writer, path, url.query, headers, head_only=method == "HEAD")
+                else:
+                    await self.send(writer, 405, body=b"Method Not Allowed")
+                if version != "HTTP/1.1" or headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    def same_origin(self, writer, headers):
+        # The Host header must name this server (not a rebound DNS name), and a browser's Origin must match it
+        host = headers.get("host", "").lower()
+        try:
+            url = urllib.parse.urlsplit("//" + host)
+            hostname, port = url.hostname, url.port
+        except ValueError:
+            return False
+        sockname = writer.get_extra_info("sockname")
+        if not hostname or sockname is None or (port or 80) != sockname[1]:
+            return False
+        if hostname not in ("localhost", sockname[0].lower()) and hostname.strip("[]") not in ("127.0.0.1", "::1"):
+            return False
+        origin = headers.get("origin")
+        return origin is None or urllib.parse.urlsplit(origin.lower()).netloc == host
+
+    async def send(self, writer, status, headers=None, body=b"", head_only=False):
+        lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}"]
+        headers = dict(headers or {})
+        headers.setdefault("Content-Length", str(len(body)))
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        if body and not head_only:
+            writer.write(body)
+        await writer.drain()
+
+    async def send_json(self, writer, value, status=200):
+        await self.send(writer, status, {"Content-Type": "application/json", "Cache-Control": "no-store"},
+                        json.dumps(value, ensure_ascii=False).encode())
+
+    async def get_selection(self, writer, headers, body):
+        await self.send_json(writer, {"selected": list(self.store.selected),
+                                      "deselected": list(self.store.deselected)})
+
+    async def post_selection(self, writer, headers, body):
+        # A JSON body cannot be sent cross-origin without a CORS preflight, which this server never allows
+        if headers.get("content-type", "").partition(";")[0].strip().lower() != "application/json":
+            await self.send(writer, 415, body=b"Unsupported Media Type")
+            return
+        try:
+            update = json.loads(body)
+            stored = self.store.append(str(update.get("page", "")), update.get("changes") or [])
+        except (ValueError, AttributeError, TypeError):
+            await self.send(writer, 400, body=b"Bad Request")
+            return
+        await self.send_json(writer, {"stored": stored})
+
+    async def get_events(self, writer, headers, body):
+        # The response has no length and stays open, every broadcast event is written to it as it comes
+        events = asyncio.Queue(maxsize=SSE_QUEUE_SIZE)
+        self.subscribers.add(events)
+        try:
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-store\r\n"
+                         b"Connection: close\r\n\r\nretry: 2000\n\n")
+            await writer.drain()
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(events.get(), SSE_HEARTBEAT)
+                    writer.write(f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode())
+                except asyncio.TimeoutError:
+                    # Comment lines keep proxies from closing the idle connection, and detect closed clients
+                    writer.write(b": keep-alive\n\n")
+                await writer.drain()
+        finally:
+            self.subscribers.discard(events)
+
+    def broadcast(self, event, data):
+        """
+        Queues a server-sent event for every open /api/events stream. Must run on the server's event loop,
+        use `loop.call_soon_threadsafe` from other threads.
+
+        Parameters:
+            event (str): The event name, "images" or "changed", see `LiveGallery.update`.
+            data: The JSON-serializable event data.
+        """
+        for events in self.subscribers:
+            try:
+                events.put_nowait((event, data))
+            except asyncio.QueueFull:
+                pass
+
+    def cache_control(self, file_path, query):
+        # Content-addressed thumbnails, sprite sheets and versioned assets never change under the same URL;
+        # everything else is revalidated with its ETag
+        if file_path.startswith((self.thumbnail_dir + os.sep, self.sprite_dir + os.sep)) or "v=" in query:
+            return "public, max-age=31536000, immutable"
+        return "no-cache"
+
+    async def send_static(self, writer, url_path, query, headers, head_only=False):
+        if url_path == "/":
+            await self.send(writer, 302, {"Location": f"/{self.pages_dir.strip('/')}/{BATCH_INDEX_PAGE}"})
+            return
+        file_path = os.path.normpath(os.path.join(self.root_dir, url_path.lstrip("/")))
+        if not any(os.path.commonpath([file_path, directory]) == directory for directory in self.served_dirs):
+            await self.send(writer, 403, body=b"Forbidden")
+            return
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            stat = None
+        if stat is None or not os.path.isfile(file_path):
+            await self.send(writer, 404, body=b"Not Found")
+            return
+
+        size = stat.st_size
+        etag = f'"{size:x}-{stat.st_mtime_ns:x}"'
+        response_headers = {
+            "ETag": etag,
+            "Last-Modified": email.utils.formatdate(stat.st_mtime, usegmt=True),
+            "Cache-Control": self.cache_control(file_path, query),
+            "Accept-Ranges": "bytes",
+        }
+        if headers.get("if-none-match") == etag:
+            await self.send(writer, 304, response_headers)
+            return
+        if "if-none-match" not in headers and "if-modified-since" in headers:
+            try:
+                since = email.utils.parsedate_to_datetime(headers["if-modified-since"]).timestamp()
+            except (TypeError, ValueError):
+                since = None
+            if since is not None and int(stat.st_mtime) <= since:
+                await self.send(writer, 304, response_headers)
+                return
+
+        status, start, end = 200, 0, size - 1
+        byte_range = _parse_byte_range(headers.get("range"), size)
+        if byte_range is not None and headers.get("if-range", etag) == etag:
+            if byte_range is False:
+                await self.send(writer, 416, {"Content-Range": f"bytes */{size}"})
+                return
+            status, (start, end) = 206, byte_range
+            response_headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        response_headers["Content-Type"] = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+        response_headers["Content-Length"] = str(end - start + 1)
+        await self.send(writer, status, response_headers)
+        if head_only:
+            return
+
+        # Stream the file in chunks, reads run on a thread so slow storage does not block other requests
+        with open(file_path, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await asyncio.to_thread(f.read, min(SERVER_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                writer.write(chunk)
+                await writer.drain()
+                remaining -= len(chunk)
+
+def _parse_byte_range(header, size):
+    # Returns (start, end) of a single "bytes=" range, False if it cannot be satisfied,
+    # or None to serve the whole file (no header, or several ranges)
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        else:
+            start, end = max(0, size - int(last)), size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        return False
+    return start, end
+
+async def _serve(server, host, port):
+    tcp_server = await asyncio.start_server(server.handle, host, port)
+    print(f"Review server is running at http://{host}:{port}/ (press Ctrl+C to stop)")
+    async with tcp_server:
+        await tcp_server.serve_forever()
+
+def serve(root_dir=".", host="127.0.0.1", port=8000, pages_dir="html", store_path=SELECTION_STORE_PATH,
+          image_dirs=SERVER_IMAGE_DIRS):
+    """
+    Runs the local review server until interrupted.
+    Reviewers open the batch pages from it instead of file://, and their selections are saved to one shared
+    append-only store instead of being downloaded as txt files.
+
+    Parameters:
+        root_dir (str): The directory served, it must contain the HTML directory, the images and the thumbnail cache.
+        host (str): The address to listen on, localhost by default.
+        port (int): The port to listen on.
+        pages_dir (str): The HTML directory relative to root_dir.
+        store_path (str): The path to the selection store, see `SelectionStore`.
+        image_dirs (tuple): The image folders relative to root_dir, served with the pages and the caches.
+    """
+    store = SelectionStore(store_path)
+    try:
+        asyncio.run(_serve(ReviewServer(root_dir, pages_dir, store, image_dirs=image_dirs), host, port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        store.close()
+
+def iter_selected_paths(txt_paths, html_dir="html", store_path=None):
+    """
+    Streams the images listed in "Save Selected Images" txt files, and optionally in the review server's store,
+    without duplicates.
+    The lines are paths relative to the HTML directory, as written by the pages, so they are resolved against html_dir.
+    Lines that do not name an `origin_*` image are skipped, so a stray line can never remove anything else.
+
+    Parameters:
+        txt_paths (list): The selection txt files.
+        html_dir (str): The directory of the HTML files the selections were saved from.
+        store_path (str): Optional selection store of the review server, see `SelectionStore`.
+
+    Yields:
+        str: The normalized path of every selected image, relative to the working directory like the group JSON.
+    """
+    def lines():
+        for txt_path in txt_paths:
+            with open(txt_path, "r", encoding="utf-8") as f:
+                yield from f
+        if store_path is not None and os.path.exists(store_path):
+            store = SelectionStore(store_path)
+            store.close()
+            yield from store.selected
+
+    seen = set()
+    for line in lines():
+        line = line.strip()
+        if not line:
+            continue
+        path = os.path.normpath(os.path.join(html_dir, line))
+        if path in seen:
+            continue
+        seen.add(path)
+        name = os.path.basename(path)
+        if not name.startswith("origin_") or os.path.splitext(name)[1].lower() not in IMAGE_EXTENSIONS:
+            print(f"Error: {line} is not an image of the demo, skipped.")
+            continue
+        yield path
+
+def _quarantine_path(path, quarantine_dir):
+    # The image keeps its folder structure under the quarantine folder, so it can be moved back
+    rel_path = os.path.relpath(os.path.abspath(path))
+    if rel_path.startswith(os.pardir):
+        rel_path = os.path.splitdrive(os.path.abspath(path))[1].lstrip(os.sep)
+    return os.path.join(quarantine_dir, rel_path)
+
+def _apply_batch(batch, action, quarantine_dir, dry_run):
+    # Deletes or moves one batch of images, returning one journal record per image
+    results = []
+    made_dirs = set()
+    for path in batch:
+        dest = _quarantine_path(path, quarantine_dir) if action == "quarantine" else None
+        try:
+            if dry_run:
+                if not os.path.exists(path):
+                    raise FileNotFoundError(path)
+            elif action == "delete":
+                os.remove(path)
+            else:
+                parent = os.path.dirname(dest)
+                if parent not in made_dirs:
+                    os.makedirs(parent, exist_ok=True)
+                    made_dirs.add(parent)
+                shutil.move(path, dest)
+            status = "done"
+        except FileNotFoundError:
+            status = "missing"
+        except OSError as e:
+            status = "failed"
+            print(f"Error: {path} cannot be {'deleted' if action == 'delete' else 'moved'}: {e}")
+        results.append({"path": path, "action": action, "dest": dest, "status": status})
+    return results
+
+def _read_apply_journal(journal_path, run):
+    # Paths already handled by an interrupted run of the same selection and action, or None when there is no journal
+    # or it was written by another run (its first line names the run) and has to be started over
+    if journal_path is None or not os.path.exists(journal_path):
+        return None
+    finished = set()
+    with open(journal_path, "r", encoding="utf-8") as f:
+        for number, line in enumerate(f):
+            try:
+                record = json.loads(line)
+                if number == 0:
+                    if record.get("run") != run:
+                        return None
+                    continue
+                if record["status"] != "failed":
+                    finished.add(record["path"])
+            except (ValueError, KeyError, TypeError, AttributeError):
+                if number == 0:
+                    return None
+                # A torn last line after a crash is skipped
+                continue
+    return finished
+
+def _selection_run_key(txt_paths, store_path=None):
+    # Identifies the selection inputs of an apply run by their paths, sizes and mtimes, see `apply_selection`
+    digest = hashlib.sha1()
+    for path in sorted(txt_paths) + ([store_path] if store_path else []):
+        try:
+            stat = os.stat(path)
+            digest.update(f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+        except OSError:
+            digest.update(f"{os.path.abspath(path)}:missing\n".encode())
+    return digest.hexdigest()
+
+def apply_selection(paths, action="quarantine", quarantine_dir=QUARANTINE_DIR, journal_path=APPLY_JOURNAL_PATH,
+                    dry_run=False, max_workers=APPLY_WORKERS, batch_size=APPLY_BATCH_SIZE, run_key=None):
+    """
+    Deletes or quarantines the given images on a bounded thread pool.
+    Images are handled in batches of batch_size per task, and each finished batch is appended to the journal with a
+    single write, so an interrupted run resumes where it stopped instead of touching every file again.
+    The journal belongs to one run, named by its action, quarantine folder and run_key: another run starts it over,
+    and it is removed once a run completes without failures.
+
+    Parameters:
+        paths (iterable): The images to remove, e.g. from `iter_selected_paths`. It is consumed lazily.
+        action (str): "quarantine" moves the images under quarantine_dir, "delete" removes them.
+        quarantine_dir (str): The folder receiving quarantined images, keeping their folder structure.
+        journal_path (str): The append-only journal of handled images, see `APPLY_JOURNAL_PATH`.
+        dry_run (bool): Only report what would be done, nothing is removed and the journal is not written.
+        max_workers (int): The number of I/O threads.
+        batch_size (int): The number of images per task and per journal write.
+        run_key (str): Identifies the selection being applied, see `_selection_run_key`.
+
+    Returns:
+        tuple: (removed, stats) where removed lists the images that are gone (removed now, by a previous run, or already
+        missing) and stats counts them by status.
+    """
+    if action not in APPLY_ACTIONS:
+        raise ValueError(f"Unknown action {action}, expected one of {APPLY_ACTIONS}")
+    run = f"{action}:{os.path.abspath(quarantine_dir)}:{run_key}"
+    finished = _read_apply_journal(journal_path, run)
+    stats = {"done": 0, "missing": 0, "failed": 0, "resumed": 0}
+    removed = []
+    journal = None
+    if not dry_run and journal_path is not None:
+        os.makedirs(os.path.dirname(journal_path) or ".", exist_ok=True)
+        if finished is None:
+            journal = open(journal_path, "w", encoding="utf-8")
+            journal.write(json.dumps({"run": run, "time": time.time()}) + "\n")
+            journal.flush()
+        else:
+            journal = open(journal_path, "a", encoding="utf-8")
+            with open(journal_path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    journal.write("\n")
+    if finished is None:
+        finished = set()
+
+    def collect(future):
+        results = future.result()
+        for result in results:
+            stats[result["status"]] += 1
+            if result["status"] != "failed":
+                removed.append(result["path"])
+        if journal is not None:
+            now = time.time()
+            journal.write("".join(json.dumps(dict(result, time=now), ensure_ascii=False) + "\n" for result in results))
+            journal.flush()
+        metrics.count("apply_" + action if not dry_run else "apply_dry_run", len(results))
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # At most two batches per thread are in flight, so a huge selection is never fully queued
+            pending = set()
+            batch = []
+            for path in paths:
+                # An image that is back on disk (e.g. moved out of the quarantine) is applied again
+                if path in finished and not os.path.lexists(path):
+                    stats["resumed"] += 1
+                    removed.append(path)
+                    continue
+                batch.append(path)
+                if len(batch) < batch_size:
+                    continue
+                pending.add(executor.submit(_apply_batch, batch, action, quarantine_dir, dry_run))
+                batch = []
+                if len(pending) >= 2 * max_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(future)
+            if batch:
+                pending.add(executor.submit(_apply_batch, batch, action, quarantine_dir, dry_run))
+            for future in pending:
+                collect(future)
+    finally:
+        if journal is not None:
+            journal.close()
+    if journal is not None and not stats["failed"]:
+        # The run is complete, there is nothing left to resume
+        os.remove(journal_path)
+    return removed, stats
+
+def forget_removed_images(removed, manifest=None, group_paths=GROUP_PATHS):
+    """
+    Drops removed images from the manifest and the saved groups. The cached listings of their folders are dropped too,
+    so the next run lists those folders again, including any image added to them meanwhile.
+
+    Parameters:
+        removed (iterable): The removed image paths, as returned by `apply_selection`.
+        manifest (dict): Optional manifest, see `load_manifest`. It is updated in place.
+        group_paths (tuple): Group indexes (.idx, see `save_group_index`) and exported group JSON files.
+    """
+    removed = set(removed)
+    if not removed:
+        return
+    if manifest is not None:
+        for path in removed:
+            manifest["files"].pop(path, None)
+            manifest["dirs"].pop(os.path.dirname(path), None)
+    for group_path in group_paths:
+        if not os.path.exists(group_path):
+            continue
+        is_index = not group_path.endswith(".json")
+        if is_index:
+            # The index is read completely and closed before it is replaced
+            with load_group_index(group_path) as index:
+                group = index.to_dict()
+        else:
+            with open(group_path, "r") as f:
+                group = json.load(f)
+        group = {template: [path for path in paths if os.path.normpath(path) not in removed]
+                 for template, paths in group.items()}
+        group = {template: paths for template, paths in group.items() if paths}
+        if is_index:
+            save_group_index(group, group_path)
+        else:
+            export_group_json(group, group_path)
+
+def apply_selection_files(txt_paths, html_dir="html", action="quarantine", quarantine_dir=QUARANTINE_DIR,
+                          journal_path=APPLY_JOURNAL_PATH, dry_run=False, store_path=None,
+                          max_workers=APPLY_WORKERS, batch_size=APPLY_BATCH_SIZE, manifest_path=MANIFEST_PATH):
+    """
+    Applies the reviewed selections (`python demo_and_select_open_source.py apply selected_images_*.txt`):
+    the selected images are deleted or quarantined, then forgotten by the manifest and the group JSON.
+
+    Parameters:
+        txt_paths (list): The "Save Selected Images" txt files.
+        html_dir (str): The directory of the HTML files the selections were saved from.
+        action, quarantine_dir, journal_path, dry_run, max_workers, batch_size: See `apply_selection`.
+        store_path (str): Optional selection store of the review server, applied together with the txt files.
+        manifest_path (str): The path to the manifest, see `load_manifest`.
+
+    Returns:
+        dict: The number of images by status.
+    """
+    paths = iter_selected_paths(txt_paths, html_dir, store_path)
+    with metrics.stage("apply"):
+        removed, stats = apply_selection(paths, action, quarantine_dir, journal_path, dry_run, max_workers, batch_size,
+                                         _selection_run_key(txt_paths, store_path))
+    verb = "would be " if dry_run else ""
+    verb += "deleted" if action == "delete" else "moved to " + quarantine_dir
+    print(f"{stats['done']} images {verb}, {stats['missing']} missing, {stats['failed']} failed, "
+          f"{stats['resumed']} already applied")
+    if not dry_run:
+        with metrics.stage("forget_removed"):
+            manifest = load_manifest(manifest_path)
+            forget_removed_images(removed, manifest)
+            save_manifest(manifest, manifest_path)
+    return stats
+
+def _inotify_init():
+    # (libc, fd) of a non-blocking inotify instance, or None where inotify is not available
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    return (libc, fd) if fd >= 0 else None
+
+class FolderWatcher:
+    """
+    Reports the folders whose entries changed under the given roots and their direct subfolders (the `origin_*`
+    folders of the leaf root), in debounced batches.
+    Uses inotify through ctypes on Linux, and polls the folder mtimes elsewhere, when inotify runs out of watches,
+    or when a poll interval is given.
+    """
+
+    def __init__(self, roots, poll_interval=None):
+        self.roots = [root for root in roots if root and os.path.isdir(root)]
+        self.poll_interval = poll_interval
+        self._inotify = _inotify_init() if poll_interval is None else None
+        self._watches = {}  # inotify watch descriptor -> folder
+        self._mtimes = {}  # folder -> mtime, when polling
+        for root in self.roots:
+            for folder in [root] + self._subfolders(root):
+                self._watch(folder)
+        if self._inotify is None:
+            self.poll_interval = poll_interval or WATCH_POLL_INTERVAL
+        print(f"Watching {', '.join(self.roots)} "
+              f"({'inotify' if self._inotify is not None else f'polling every {self.poll_interval}s'})")
+
+    @staticmethod
+    def _subfolders(root):
+        try:
+            with os.scandir(root) as it:
+                return [entry.path for entry in it if entry.is_dir()]
+        except OSError:
+            return []
+
+    def _watch(self, folder):
+        if self._inotify is not None:
+            libc, fd = self._inotify
+            wd = libc.inotify_add_watch(fd, os.fsencode(folder), _IN_WATCH_MASK)
+            if wd >= 0:
+                self._watches[wd] = folder
+                return
+            # Usually ENOSPC (fs.inotify.max_user_watches), every folder is polled instead
+            print(f"Error: inotify cannot watch {folder}: {os.strerror(ctypes.get_errno())}, polling instead.")
+            os.close(fd)
+            self._inotify = None
+            self.poll_interval = self.poll_interval or WATCH_POLL_INTERVAL
+            for watched in self._watches.values():
+                self._watch(watched)
+            self._watches = {}
+        try:
+            self._mtimes[folder] = os.stat(folder).st_mtime_ns
+        except OSError:
+            pass
+
+    def wait(self, timeout=None):
+        """
+        Waits for changes, then keeps collecting them until none arrived for WATCH_DEBOUNCE seconds
+        (or WATCH_MAX_DELAY passed), so a scraper writing many files produces one batch.
+
+        Parameters:
+            timeout (float): The maximum time to wait for a first change, None waits forever.
+
+        Returns:
+            set: The changed folders, empty if the timeout expired.
+        """
+        if self._inotify is None:
+            time.sleep(self.poll_interval if timeout is None else min(self.poll_interval, timeout))
+            return self._poll()
+        fd = self._inotify[1]
+        if not select.select([fd], [], [], timeout)[0]:
+            return set()
+        changed = set()
+        deadline = time.monotonic() + WATCH_MAX_DELAY
+        while True:
+            changed |= self._read_events()
+            remaining = min(WATCH_DEBOUNCE, deadline - time.monotonic())
+            if self._inotify is None or remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                return changed
+
+    def _read_events(self):
+        changed = set()
+        try:
+            data = os.read(self._inotify[1], 1 << 16)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = struct.unpack_from("iIII", data, offset)
+            name = os.fsdecode(data[offset + 16:offset + 16 + length].rstrip(b"\0"))
+            offset += 16 + length
+            if mask & _IN_Q_OVERFLOW:
+                changed.update(self._watches.values())
+                continue
+            folder = self._watches.get(wd)
+            if folder is None:
+                continue
+            if mask & _IN_IGNORED:
+                # The folder itself was removed
+                del self._watches[wd]
+                changed.add(folder)
+                continue
+            if mask & _IN_ISDIR:
+                if folder in self.roots and mask & (_IN_CREATE | _IN_MOVED_TO):
+                    subfolder = os.path.join(folder, name)
+                    self._watch(subfolder)
+                    changed.add(subfolder)
+            elif mask & _IN_CREATE:
+                # Files are reported once they are closed after writing (or moved in), not while being written
+                continue
+            changed.add(folder)
+        return changed
+
+    def _poll(self):
+        changed = set()
+        for folder, mtime in list(self._mtimes.items()):
+            try:
+                current = os.stat(folder).st_mtime_ns
+            except OSError:
+                del self._mtimes[folder]
+                changed.add(folder)
+                continue
+            if current != mtime:
+                self._mtimes[folder] = current
+                changed.add(folder)
+                if folder in self.roots:
+                    for subfolder in self._subfolders(folder):
+                        if subfolder not in self._mtimes:
+                            self._watch(subfolder)
+                            changed.add(subfolder)
+        return changed
+
+    def close(self):
+        if self._inotify is not None:
+            os.close(self._inotify[1])
+            self._inotify = None
+
+class LiveGallery:
+    """
+    State of `watch` mode: the groups, thumbnails, probes and pages of the last build, updated folder by folder as
+    images are added or removed instead of re-running the whole pipeline. Each update returns the events to push to
+    the pages opened from the review server: the images appended to a page, or the pages that have to be reloaded.
+    """
+
+    def __init__(self, leaf_dir_path, src_folder_path, output_dir, leaf_group, src_group, thumbnails, probes, manifest,
+                 preselected, batch_stats, demo_lines=25, render_mode="table", max_images=None, max_bytes=None,
+                 near_duplicate_threshold=PHASH_THRESHOLD, manifest_path=MANIFEST_PATH):
+        self.leaf_dir_path = leaf_dir_path
+        self.src_folder_path = src_folder_path
+        self.output_dir = output_dir
+        self.leaf_group = leaf_group  # `GroupStore`s, updated in place
+        self.src_group = src_group
+        self.thumbnails = thumbnails
+        self.probes = probes
+        self.manifest = manifest
+        self.preselected = preselected
+        self.batch_stats = batch_stats
+        self.demo_lines = demo_lines
+        self.render_mode = render_mode
+        self.max_images = max_images
+        self.max_bytes = max_bytes
+        self.near_duplicate_threshold = near_duplicate_threshold
+        self.manifest_path = manifest_path
+        self.deferred = {}  # path -> (is_leaf, template) of images that still looked incomplete
+
+    def _rescan(self, folder, is_leaf, added, removed):
+        # Diffs the listing of one folder against the one stored in the manifest
+        pattern = LEAF_NAME_PATTERN if is_leaf else SRC_NAME_PATTERN
+        previous = set(self.manifest["dirs"].get(folder, {}).get("files", ()))
+        if os.path.isdir(folder):
+            pairs = list(_scan_image_folder(folder, pattern, self.manifest))
+            current = set(self.manifest["dirs"].get(folder, {}).get("files", ()))
+        else:
+            pairs = []
+            current = set()
+            self.manifest["dirs"].pop(folder, None)
+        for template, path in pairs:
+            if os.path.basename(path) not in previous:
+                added[path] = (is_leaf, template)
+        for name in previous - current:
+            match = pattern.match(os.path.splitext(name)[0])
+            if match is not None:
+                removed.setdefault((is_leaf, match.group(1)), set()).add(os.path.join(folder, name))
+
+    def _image_event(self, path, resolve):
+        # An appended image as sent to the pages, with paths relative to the HTML directory
+        probe = self.probes.get(path)
+        width, height = _fit_size(probe[:2], LEAF_THUMBNAIL_SIZE) if probe and probe[0] else (0, 0)
+        return {"original": "".join(resolve(path)), "thumb": "".join(resolve(self.thumbnails.get(path, path))),
+                "width": width, "height": height, "checked": path in self.preselected}
+
+    def update(self, changed_folders):
+        """
+        Applies a batch of changed folders (see `FolderWatcher.wait`) to the groups and rewrites the pages
+        whose contents changed.
+
+        Parameters:
+            changed_folders (set): The folders whose entries changed.
+
+        Returns:
+            list: (event, data) tuples for `ReviewServer.broadcast`: "images" {"page", "groups", "selected"} for a page
+                whose rows only gained images at their end (and possibly new pre-selections), "changed" {"pages"}
+                for the pages to reload.
+        """
+        added, removed = {}, {}
+        leaf_root = os.path.normpath(self.leaf_dir_path)
+        src_root = os.path.normpath(self.src_folder_path) if self.src_folder_path else None
+        # Subfolders that appear or disappear under the leaf root are reported on their own
+        for folder in sorted(changed_folders):
+            if os.path.normpath(folder) == src_root:
+                self._rescan(folder, False, added, removed)
+            elif (os.path.dirname(os.path.normpath(folder)) == leaf_root
+                    and os.path.basename(os.path.normpath(folder)).startswith("origin_")):
+                self._rescan(folder, True, added, removed)
+
+        # Images that are still being written are retried on the next batch
+        added.update(self.deferred)
+        self.deferred = {}
+        preselected_before = set(self.preselected)
+        for paths in removed.values():
+            for path in paths:
+                added.pop(path, None)
+        probes = probe_images({None: list(added)}, {}, manifest=self.manifest) if added else {}
+        self.probes.update(probes)
+        now = time.time()
+        accepted = {True: {}, False: {}}
+        for path, (is_leaf, template) in added.items():
+            if probes[path][4] is not None:
+                try:
+                    recent = now - os.path.getmtime(path) < WATCH_SETTLE_SECONDS
+                except OSError:
+                    continue
+                if recent:
+                    self.deferred[path] = (is_leaf, template)
+                    continue
+                if is_leaf:
+                    template = BROKEN_TEMPLATE
+                    self.preselected.add(path)
+            accepted[is_leaf].setdefault(template, []).append(path)
+
+        for (is_leaf, template), paths in removed.items():
+            group = self.leaf_group if is_leaf else self.src_group
+            for name in (template, BROKEN_TEMPLATE) if is_leaf else (template,):
+                group.discard(name, paths)
+            for path in paths:
+                self.thumbnails.pop(path, None)
+                self.probes.pop(path, None)
+                self.preselected.discard(path)
+                self.manifest["files"].pop(path, None)
+        for is_leaf, group in ((True, self.leaf_group), (False, self.src_group)):
+            for template, paths in accepted[is_leaf].items():
+                for path in paths:
+                    group.add(template, path)
+
+        if accepted[True] or accepted[False]:
+            self.thumbnails.update(build_thumbnail_cache(accepted[True], accepted[False], manifest=self.manifest,
+                                                         prune_manifest=False, probes=self.probes))
+            if self.near_duplicate_threshold is not None:
+                templates = set(accepted[True]) | set(accepted[False])
+                leaf_hashes, src_hashes = compute_perceptual_hashes(
+                    {t: list(self.leaf_group[t]) for t in templates if t in self.leaf_group},
+                    {t: list(self.src_group[t]) for t in templates if t in self.src_group}, manifest=self.manifest,
+                    probes=self.probes)
+                self.preselected.update(find_near_duplicates(leaf_hashes, src_hashes, self.near_duplicate_threshold))
+        if not (accepted[True] or accepted[False] or removed):
+            return []
+
+        previous_pages = dict(self.manifest["pages"])
+        previous_stats = {page["page"]: page for page in self.batch_stats}
+        self.batch_stats = visualize_scratch_in_root(
+            self.leaf_group, self.src_group, self.output_dir, self.demo_lines, self.thumbnails, self.manifest,
+            self.render_mode, self.max_images, self.max_bytes, None, self.preselected, self.probes)
+        save_manifest(self.manifest, self.manifest_path)
+
+        appended = {path for paths in accepted[True].values() for path in paths}
+        changed_templates = {template for is_leaf, template in removed if is_leaf} | set(accepted[False])
+        resolve = _relpath_resolver(self.output_dir)
+        events, reload_pages = [], []
+        for page in self.batch_stats:
+            output_path = os.path.join(self.output_dir, page["page"])
+            if previous_pages.get(output_path) == self.manifest["pages"].get(output_path):
+                continue
+            before = previous_stats.get(page["page"])
+            templates = [template for template, _, _ in page["slices"]]
+            if (before is None or [template for template, _, _ in before["slices"]] != templates
+                    or changed_templates & set(templates)):
+                reload_pages.append(page["page"])
+                continue
+            groups, selected = [], []
+            for (template, first, last), (_, old_first, old_last) in zip(page["slices"], before["slices"]):
+                images = list(self.leaf_group[template][first:last])
+                shown = [path for path in images if path not in appended]
+                new = images[len(shown):]
+                # The open page can only be extended at the end of a row: the images it shows must be exactly the
+                # ones it showed before (none sorted in between or moved to another page), followed by the new ones
+                previous = [path for path in self.leaf_group[template] if path not in appended][old_first:old_last]
+                if shown != previous or any(path not in appended for path in new):
+                    groups = None
+                    break
+                selected += [path for path in shown if path in self.preselected and path not in preselected_before]
+                if new:
+                    groups.append({"template": template, "images": [self._image_event(path, resolve) for path in new]})
+            if groups or (groups is not None and selected):
+                events.append(("images", {"page": page["page"], "groups": groups,
+                                          "selected": ["".join(resolve(path)) for path in selected]}))
+            else:
+                reload_pages.append(page["page"])
+        reload_pages += [page for page in previous_stats if page not in {p["page"] for p in self.batch_stats}]
+        if reload_pages:
+            events.append(("changed", {"pages": reload_pages}))
+        print(f"{len(appended) + sum(map(len, accepted[False].values()))} images added, "
+              f"{sum(map(len, removed.values()))} removed, {len(self.deferred)} still being written")
+        return events
+
+def watch(gallery, host="127.0.0.1", port=8000, store_path=SELECTION_STORE_PATH, poll_interval=None, root_dir="."):
+    """
+    Runs the review server and keeps the pages up to date until interrupted (`python demo_and_select_open_source.py watch`).
+    A thread waits for changed folders and applies them with `LiveGallery.update`; the resulting events are pushed to
+    the open pages over server-sent events, so new images appear without a reload.
+
+    Parameters:
+        gallery (LiveGallery): The state of the initial build.
+        host (str): The address to listen on, localhost by default.
+        port (int): The port to listen on.
+        store_path (str): The path to the selection store, see `SelectionStore`.
+        poll_interval (float): Poll the folders every poll_interval seconds instead of using inotify.
+        root_dir (str): The directory served, it must contain the HTML directory, the images and the thumbnail cache.
+    """
+    store = SelectionStore(store_path)
+    server = ReviewServer(root_dir, gallery.output_dir, store,
+                          image_dirs=(gallery.leaf_dir_path, gallery.src_folder_path))
+    watcher = FolderWatcher([gallery.leaf_dir_path, gallery.src_folder_path], poll_interval)
+    stop = threading.Event()
+
+    async def main():
+        loop = asyncio.get_running_loop()
+
+        def run():
+            while not stop.is_set():
+                try:
+                    changed = watcher.wait(timeout=WATCH_SETTLE_SECONDS)
+                except Exception as e:
+                    # The server keeps running, so this thread must not die silently; retry after a pause
+                    print(f"Error: Failed to watch the folders: {e}")
+                    stop.wait(WATCH_SETTLE_SECONDS)
+                    continue
+                if not changed and not gallery.deferred:
+                    continue
+                try:
+                    events = gallery.update(changed)
+                except (OSError, ValueError) as e:
+                    print(f"Error: Failed to update the pages: {e}")
+                    continue
+                for event, data in events:
+                    loop.call_soon_threadsafe(server.broadcast, event, data)
+
+        threading.Thread(target=run, daemon=True).start()
+        await _serve(server, host, port)
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        watcher.close()
+        store.close()
+
+def _build_arg_parser():
+    parser = argparse.ArgumentParser(description="Demonstrate images in HTML pages and select them in the browser.")
+    parser.add_argument("--profile", action="store_true",
+                        help=f"Profile the run with cProfile ({PROFILE_PATH}) and tracemalloc (added to the metrics).")
+    parser.add_argument("--metrics", default=METRICS_PATH, help="JSON file receiving the per-stage timings and counters.")
+    parser.add_argument("--export-json", action="store_true",
+                        help="Also write the groups as json/leaf_group.json and json/src_group.json.")
+    subparsers = parser.add_subparsers(dest="command")
+    serve_parser = subparsers.add_parser("serve", help="Serve the batch pages on localhost and store selections on the server.")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8000)
+    serve_parser.add_argument("--root", default=".", help="Directory served, containing the pages, images and thumbnails.")
+    serve_parser.add_argument("--pages", default="html", help="HTML directory relative to --root.")
+    serve_parser.add_argument("--store", default=SELECTION_STORE_PATH, help="Append-only selection store.")
+    serve_parser.add_argument("--images", nargs="+", default=SERVER_IMAGE_DIRS, metavar="DIR",
+                              help="Image folders relative to --root, served with the pages and the caches.")
+    watch_parser = subparsers.add_parser("watch", help="Build the pages, then serve them and add new images as they arrive.")
+    watch_parser.add_argument("--host", default="127.0.0.1")
+    watch_parser.add_argument("--port", type=int, default=8000)
+    watch_parser.add_argument("--store", default=SELECTION_STORE_PATH, help="Append-only selection store.")
+    watch_parser.add_argument("--poll", type=float, default=None, metavar="SECONDS",
+                              help="Poll the folders every SECONDS instead of using inotify.")
+    apply_parser = subparsers.add_parser("apply", help="Delete or quarantine the images listed in selection txt files.")
+    apply_parser.add_argument("selections", nargs="*", help="The selected_images_*.txt files saved from the pages.")
+    apply_parser.add_argument("--html", default="html", help="HTML directory the selections were saved from.")
+    apply_parser.add_argument("--action", choices=APPLY_ACTIONS, default="quarantine")
+    apply_parser.add_argument("--quarantine", default=QUARANTINE_DIR, help="Folder receiving quarantined images.")
+    apply_parser.add_argument("--journal", default=APPLY_JOURNAL_PATH, help="Journal used to resume an interrupted run.")
+    apply_parser.add_argument("--store", default=None, help="Also apply the selection store of the review server.")
+    apply_parser.add_argument("--dry-run", action="store_true", help="Only report what would be done.")
+    apply_parser.add_argument("--workers", type=int, default=APPLY_WORKERS)
+    apply_parser.add_argument("--batch-size", type=int, default=APPLY_BATCH_SIZE)
+    return parser
+
+if __name__ == "__main__":
+    # In this case, one image and some similar images can seen as a group. Their filenames can indicate their relationship uniquely.
+    # 本代码解决的是，一张图片与多张图片有对应关系，需要检查并删去多张图片中的不合格图片，常用于手动筛选爬取后的不良图片。 HTML最后会给出你框选的图片路径txt
+    """
+    1. Click the frame/button of your targer images, and then click the red button on the top right to [Save Selected Images]/[ctrl + s] to save the selected images' path txt file.
+    You will find a txt file downloaded in your device, which contains the selected images paths.
+    2. Load the selected txt file by clicking the red button on the top left to [Load Selected Info]/[ctrl + d].
+    1. 保存：勾选框，点击图片或者左键框选需要删除的图片，在确认勾选图片正确之后，点击右上角绿色按钮[Save Selected Images]/[ctrl + s],即可保存该demo文件的目标图片路径txt。
+    2. 载入：导入selected_txt，检查选择的图片质量，点击左上角红色按钮[Load Selected Info]/[ctrl + d]
+    3. Serve: run `python demo_and_select_open_source.py serve` and open http://127.0.0.1:8000/ instead of the HTML files.
+    Selections are then saved on the server in json/selections.jsonl, shared by every page and reviewer, without downloads.
+    3. 服务：运行 `python demo_and_select_open_source.py serve` 并打开 http://127.0.0.1:8000/ 代替直接打开HTML文件，
+    勾选结果会自动保存到服务器的 json/selections.jsonl 中，所有页面和审核者共享，无需下载txt。
+    4. Apply: run `python demo_and_select_open_source.py apply selected_images_*.txt [--store json/selections.jsonl]`
+    to move the selected images to quarantine/ (or `--action delete`), add `--dry-run` to check the selection first.
+    4. 执行：运行 `python demo_and_select_open_source.py apply selected_images_*.txt`，将勾选的图片移动到 quarantine/
+    （或使用 `--action delete` 直接删除），可先加 `--dry-run` 检查。
+    5. Watch: run `python demo_and_select_open_source.py watch` instead of `serve` while images are still being scraped.
+    New images are added to the pages, and appear in the pages already open without a reload.
+    5. 监视：图片仍在爬取时运行 `python demo_and_select_open_source.py watch` 代替 `serve`，
+    新图片会增量加入页面，已打开的页面无需刷新即可显示。
+    """
+    args = _build_arg_parser().parse_args()
+    if args.command == "serve":
+        serve(args.root, args.host, args.port, args.pages, args.store, args.images)
+        sys.exit(0)
+    if args.command == "apply":
+        stats = apply_selection_files(args.selections, args.html, args.action, args.quarantine, args.journal,
+                                      args.dry_run, args.store, args.workers, args.batch_size)
+        metrics.save(args.metrics)
+        sys.exit(1 if stats["failed"] else 0)
+
+    # Timings and counters of every stage are written to json/metrics.json; --profile adds cProfile and tracemalloc
+    # 每个阶段的耗时和计数写入 json/metrics.json；--profile 额外开启 cProfile 和 tracemalloc
+    profiler = start_profiling() if args.profile else None
+
+    # Results of the previous run, only new or changed images and pages are processed again
+    # 上一次运行的结果，只重新处理新增或改动的图片和页面
+    with metrics.stage("load_manifest"):
+        manifest = load_manifest(MANIFEST_PATH)
+
+    # Image selected from source folder
+    # src_folder_path can be none, and source column will be empty in the HTML file
+    src_folder_path = 'data/src'
+    with metrics.stage("scan_src"):
+        src_group = read_src_img(src_folder_path, manifest)
+
+    # Image selected from leaf folder
+    leaf_dir_path = "data/leaf"
+    with metrics.stage("scan_leaf"):
+        leaf_group = read_leaf_img(leaf_dir_path, manifest)
+
+    # Optional: Check the source and leaf image groups, saved as compact indexes (`load_group_index`),
+    # and as indented JSON with --export-json
+    # 可选：检查源图和叶子图的分组，保存为紧凑的索引文件（`load_group_index` 读取），使用 --export-json 时同时导出JSON
+    with metrics.stage("dump_groups"):
+        save_group_index(leaf_group, LEAF_GROUP_INDEX_PATH)
+        save_group_index(src_group, SRC_GROUP_INDEX_PATH)
+        if args.export_json:
+            export_group_json(leaf_group, "json/leaf_group.json")
+            export_group_json(src_group, "json/src_group.json")
+        else:
+            # JSON exported by an earlier run is kept, but it may no longer match the groups
+            for json_path in ("json/leaf_group.json", "json/src_group.json"):
+                if os.path.exists(json_path):
+                    print(f"Warning: {json_path} was exported by an earlier run and may be stale, "
+                          f"run with --export-json to update it")
+
+    # Number of groups in one demo file. The number depends on your device and the average number of images per group.
     # If lines are too large, make sure your device is capable of R/W lots of images
     lines_per_file = 25  # default
 
+    # Optional: also cut pages by the number of images and/or the thumbnail bytes they load, a template larger than
+    # the limits is split across pages. Per-page costs are written to json/batch_stats.json to tune these values.
+    # 可选：按图片数量和/或缩略图字节数切分页面，超出限制的组会被拆分到多个页面。每页的开销写入 json/batch_stats.json。
+    max_images_per_file = None  # e.g. 2000
+    max_bytes_per_file = None  # e.g. 200 * 1024 * 1024
+
+    # "table" renders every image up front; "virtual" only draws the rows in the viewport,
+    # use it when some templates have thousands of images
+    # 当某些组有成千上万张图片时使用 "virtual"，页面只渲染视口内的图片
+    # "sprite" packs each row into one sprite sheet, use it on file:// or network shares where every file open is slow
+    # "sprite" 将每行图片合并为一张拼图，适用于 file:// 或网络共享目录等打开文件较慢的场景
+    render_mode = "table"  # default
+
+
+    # Image sizes read from the file headers, so the pages do not reflow; truncated or unreadable files are detected
+    # 从文件头读取图片尺寸，页面加载时不再跳动；同时检测截断或无法读取的文件
+    with metrics.stage("probe"):
+        probes = probe_images(leaf_group, src_group, manifest=manifest)
+
+    # Downscaled copies shown in the pages instead of the full-resolution originals
+    # 页面中显示缩略图而不是原图，减少浏览器解码的像素量
+    with metrics.stage("thumbnails"):
+        thumbnails = build_thumbnail_cache(leaf_group, src_group, THUMBNAIL_CACHE_DIR, manifest=manifest, probes=probes)
 
     # demo directory
     demo_dir_path = "html"
-    visualize_scratch_in_root(leaf_group, src_group, demo_dir_path, lines_per_file)
+
+    # Optional: pre-select near-duplicates within each group and of the source image, set to None to disable.
+    # They are also exported in the "Save Selected Images" txt format, to be loaded or applied later.
+    # 可选：预先勾选组内以及与源图近似重复的图片，设为 None 关闭；同时导出为与保存按钮相同格式的txt。
+    near_duplicate_threshold = PHASH_THRESHOLD
+    near_duplicates = {}
+    if near_duplicate_threshold is not None:
+        with metrics.stage("perceptual_hashes"):
+            leaf_hashes, src_hashes = compute_perceptual_hashes(leaf_group, src_group, manifest=manifest, probes=probes)
+        with metrics.stage("near_duplicates"):
+            near_duplicates = find_near_duplicates(leaf_hashes, src_hashes, near_duplicate_threshold)
+        export_selection_txt(sorted(near_duplicates), "json/selected_images_near_duplicates.txt", demo_dir_path)
+        print(f"{len(near_duplicates)} near-duplicate images are pre-selected")
+
+    # Broken images are gathered in a pre-selected "broken" group on the last page, and exported like the near-duplicates
+    # 损坏的图片集中到最后一页预先勾选的 "broken" 组中，并像近似重复图片一样导出
+    leaf_group, broken_images = route_broken_images(leaf_group, probes)
+    if broken_images:
+        export_selection_txt(sorted(broken_images), "json/selected_images_broken.txt", demo_dir_path)
+        print(f"{len(broken_images)} broken images are pre-selected")
+
+    preselected = set(near_duplicates) | broken_images
+    with metrics.stage("html"):
+        batch_stats = visualize_scratch_in_root(leaf_group, src_group, demo_dir_path, lines_per_file, thumbnails, manifest,
+                                                render_mode, max_images_per_file, max_bytes_per_file,
+                                                "json/batch_stats.json", preselected, probes)
+    with metrics.stage("save_manifest"):
+        save_manifest(manifest, MANIFEST_PATH)
+
+    if profiler is not None:
+        stop_profiling(profiler, PROFILE_PATH)
+    metrics.save(args.metrics)
+
+    # watch: keep serving the pages, and add the images written to the leaf and source folders from now on
+    # watch：继续提供页面服务，之后写入叶子和源图目录的新图片会增量加入页面，并实时推送到已打开的页面
+    if args.command == "watch":
+        gallery = LiveGallery(leaf_dir_path, src_folder_path, demo_dir_path, leaf_group, src_group, thumbnails, probes,
+                              manifest, preselected, batch_stats, lines_per_file, render_mode, max_images_per_file,
+                              max_bytes_per_file, near_duplicate_threshold)
+        watch(gallery, args.host, args.port, args.store, args.poll)